@@ -2,18 +2,22 @@ import statsapi
 import pandas as pd
 import json
 from datetime import date, timedelta
-import mlbstatsapi
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from cache import ResponseCache
+from storage import TABLES, get_storage
+from watermark import Watermark
 from util import (
+    call_with_retries,
     get_american_teams,
     merge_team_stats,
     add_identifying_fields_to_dict,
     add_player_stats,
+    box_score_player_ids,
+    people,
     print_object_fields,
 )
 
-mlb = mlbstatsapi.Mlb()
-
 # Display all columns
 pd.set_option("display.max_columns", None)
 
@@ -26,55 +30,70 @@ pd.set_option("display.max_colwidth", None)
 
 class DataFetcher:
 
-    def __init__(self, season, use_existing=True):
+    def __init__(
+        self,
+        season,
+        use_existing=True,
+        workers=8,
+        retries=3,
+        backoff=1.0,
+        cache=None,
+        storage=None,
+        batch_size=100,
+    ):
         self.season = season
-        self.existing_games = pd.DataFrame()
-        self.existing_team_stats = pd.DataFrame()
-        self.existing_pitching_stats = pd.DataFrame()
-        self.existing_fielding_stats = pd.DataFrame()
-        self.existing_batting_stats = pd.DataFrame()
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache or ResponseCache()
+        self.storage = storage or get_storage()
+        self.final_games = set()
+        self.batch_size = batch_size
+        self.watermark = Watermark(self.storage.watermark_path(season))
         self.use_existing = use_existing
+        # Offline runs use the handedness already in people.json
+        people.offline = self.cache.offline
         self.fetch_and_save_data()
 
     def find_existing_data(self):
-        try:
-            self.existing_games = pd.read_csv(f"{self.season}_games.csv")
-            self.existing_team_stats = pd.read_csv(f"{self.season}_team_stats.csv")
-            self.existing_fielding_stats = pd.read_csv(
-                f"{self.season}_fielding_stats.csv"
-            )
-            self.existing_batting_stats = pd.read_csv(
-                f"{self.season}_batting_stats.csv"
-            )
-            self.existing_pitching_stats = pd.read_csv(
-                f"{self.season}_pitching_stats.csv"
+        if not self.use_existing:
+            # The empty watermark is saved before any table is dropped, a
+            # crash in between must not leave games marked as ingested
+            self.watermark.reset()
+            self.watermark.save()
+            for table in TABLES:
+                self.storage.drop(table, self.season)
+            return
+
+        # Discard anything written by a batch that never committed
+        self.storage.rollback(self.season, self.watermark.batches)
+
+        if self.watermark.empty():
+            existing_team_stats = self.storage.read(
+                "team", [self.season], columns=["game_id", "date"]
             )
-        except:
-            print("Existing data not found")
+            if existing_team_stats.empty:
+                print("Existing data not found")
+            else:
+                # Data written before watermarks existed
+                self.watermark.update(
+                    existing_team_stats["game_id"], existing_team_stats["date"]
+                )
 
     def data_exists(self, game_id):
-        return (
-            not self.existing_team_stats.empty
-            and game_id in self.existing_team_stats["game_id"].unique()
-        )
+        return game_id in self.watermark.game_ids
 
-    def get_regular_season_games(self):
-        american_teams = get_american_teams()
-        if self.season == 2024:
-            yesterday = date.today() - timedelta(days=1)
-            yesterday.strftime("%y-%m-%d")
-            schedule = mlb.get_schedule(
-                start_date=f"{self.season}-01-01",
-                end_date=yesterday,
-                gameTypes="R",
-            )
-        else:
-            schedule = mlb.get_schedule(
-                start_date=f"{self.season}-01-01",
-                end_date=f"{self.season}-12-31",
-                gameTypes="R",
-            )
+    def schedule_start(self):
+        # Incremental runs only need the schedule from the last ingested date, or
+        # the earliest game a previous run couldn't fetch, on
+        if self.use_existing and self.watermark.start_date():
+            return self.watermark.start_date()
+        return f"{self.season}-01-01"
+
+    def schedule_games(self, schedule, american_teams):
         games = []
+        if schedule is None:
+            return games
         for day in schedule.dates:
             for game in day.games:
                 if game.status.detailedstate != "Postponed" and (
@@ -84,223 +103,210 @@ class DataFetcher:
                     )
                 ):
                     games.append((game.gamepk, day.date))
+                    if game.status.abstractgamestate == "Final":
+                        self.final_games.add(game.gamepk)
         return games
 
-    def get_playoff_games(self):
-        american_teams = get_american_teams()
-        if self.season == 2024:
-            return []
-            yesterday = date.today() - timedelta(days=1)
-            yesterday.strftime("%y-%m-%d")
-            schedule = mlb.get_schedule(
-                start_date=f"{self.season}-01-01",
-                end_date=yesterday,
-                gameTypes=["F", "D", "L", "W"],
-            )
+    def get_season_games(self):
+        # One schedule request covers the regular season and every playoff round
+        american_teams = set()
+        if self.season < 2022:
+            american_teams = get_american_teams(self.cache)
+        if self.season == date.today().year:
+            end_date = date.today() - timedelta(days=1)
         else:
-            schedule = mlb.get_schedule(
-                start_date=f"{self.season}-01-01",
-                end_date=f"{self.season}-12-31",
-                gameTypes=["F", "D", "L", "W"],
-            )
-        games = []
-        for day in schedule.dates:
-            for game in day.games:
-                if game.status.detailedstate != "Postponed" and (
-                    (self.season >= 2022)
-                    or (
-                        self.season < 2022 and game.teams.home.team.id in american_teams
-                    )
-                ):
-                    games.append((game.gamepk, day.date))
-        return games
+            end_date = f"{self.season}-12-31"
+        schedule = self.cache.get_schedule(
+            self.schedule_start(),
+            end_date,
+            ["R", "F", "D", "L", "W"],
+        )
+        return self.schedule_games(schedule, american_teams)
+
+    def fetch_box_score(self, game):
+        return call_with_retries(
+            self.cache.get_box_score,
+            game,
+            final=game in self.final_games,
+            retries=self.retries,
+            backoff=self.backoff,
+        )
 
-    def concatenate_existing_data(
-        self, team_stats, pitcher_stats, batter_stats, fielder_stats, games
+    def fetch_box_scores(self, games):
+        # Box scores are downloaded concurrently, executor.map yields them back
+        # in the order of the games list
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            box_scores = executor.map(self.fetch_box_score, [game for game, _ in games])
+            for count, box_score in enumerate(box_scores):
+                if count % 10 == 0:
+                    print(f"{count} / {len(games)}")
+                yield box_score
+
+    def add_box_score(
+        self,
+        box_score,
+        game,
+        date,
+        team_stats,
+        pitcher_stats,
+        batter_stats,
+        fielder_stats,
+        games,
     ):
-        if (
-            self.use_existing
-            and not self.existing_team_stats.empty
-            and len(team_stats) != 0
-        ):
-            team_df = pd.concat(
-                [self.existing_team_stats, pd.DataFrame(team_stats)],
-                ignore_index=True,
-            )
-        elif len(team_stats) == 0:
-            team_df = self.existing_team_stats
-        else:
-            team_df = pd.DataFrame(team_stats)
-
-        if (
-            self.use_existing
-            and not self.existing_pitching_stats.empty
-            and len(pitcher_stats) != 0
-        ):
-            pitcher_df = pd.concat(
-                [self.existing_pitching_stats, pd.DataFrame(pitcher_stats)],
-                ignore_index=True,
-            )
-        elif len(pitcher_stats) == 0:
-            pitcher_df = self.existing_pitching_stats
-        else:
-            pitcher_df = pd.DataFrame(pitcher_stats)
-
-        if (
-            self.use_existing
-            and not self.existing_batting_stats.empty
-            and len(batter_stats) != 0
-        ):
-            batter_df = pd.concat(
-                [
-                    self.existing_batting_stats,
-                    pd.DataFrame(batter_stats),
-                ],
-                ignore_index=True,
-            )
-        elif len(batter_stats) == 0:
-            batter_df = self.existing_batting_stats
-        else:
-            batter_df = pd.DataFrame(batter_stats)
-
-        if (
-            self.use_existing
-            and not self.existing_fielding_stats.empty
-            and len(fielder_stats) != 0
-        ):
-            fielder_df = pd.concat(
-                [
-                    self.existing_fielding_stats,
-                    pd.DataFrame(fielder_stats),
-                ],
-                ignore_index=True,
-            )
-        elif len(fielder_stats) == 0:
-            fielder_df = self.existing_fielding_stats
-        else:
-            fielder_df = pd.DataFrame(fielder_stats)
-
-        if self.use_existing and not self.existing_games.empty and len(games) != 0:
-            games_df = pd.concat(
-                [
-                    self.existing_games,
-                    pd.DataFrame(games),
-                ],
-                ignore_index=True,
-            )
-        elif len(games) == 0:
-            games_df = self.existing_games
-        else:
-            games_df = pd.DataFrame(games)
+        home_team = box_score.teams.home
+        away_team = box_score.teams.away
+
+        games.append(
+            {
+                "game_id": game,
+                "home_team": home_team.team.name,
+                "home_score": home_team.teamstats["batting"]["runs"],
+                "home_id": home_team.team.id,
+                "away_team": away_team.team.name,
+                "away_score": away_team.teamstats["batting"]["runs"],
+                "away_id": away_team.team.id,
+                "date": date,
+            }
+        )
 
-        return team_df, pitcher_df, batter_df, fielder_df, games_df
+        home_win = (
+            home_team.teamstats["batting"]["runs"]
+            > away_team.teamstats["batting"]["runs"]
+        )
 
-    def fetch_stats(self):
+        team_stats.append(merge_team_stats(home_team, date, game, home_win, True))
+        team_stats.append(merge_team_stats(away_team, date, game, not home_win, False))
 
-        team_stats = []
-        pitcher_stats = []
-        batter_stats = []
-        fielder_stats = []
-        games = []
+        add_player_stats(
+            home_team,
+            date,
+            pitcher_stats,
+            batter_stats,
+            fielder_stats,
+            game,
+        )
+        add_player_stats(
+            away_team,
+            date,
+            pitcher_stats,
+            batter_stats,
+            fielder_stats,
+            game,
+        )
 
-        game_ids = self.get_regular_season_games()
-        playoff_ids = self.get_playoff_games()
-        count = 0
-        done_games = set()
-        for game, date in game_ids + playoff_ids:
-            if count % 10 == 0:
-                print(f"{count} / {len(game_ids + playoff_ids)}")
+    def save_batch(
+        self, batch, team_stats, pitcher_stats, batter_stats, fielder_stats, games
+    ):
+        team_df = pd.DataFrame(team_stats).sort_values(by=["date"])
 
-            if game in done_games:
-                print(game)
-                continue
+        pitching_df = pd.DataFrame(pitcher_stats).sort_values(by=["name", "date"])
 
-            count += 1
-            if game == 661702:
-                print(game)
+        batter_df = pd.DataFrame(batter_stats)
+        batter_df = batter_df[batter_df["atbats"] > 0].sort_values(by=["name", "date"])
 
-            if not self.use_existing or not self.data_exists(game):
-                done_games.add(game)
-                box_score = mlb.get_game_box_score(game)
-
-                home_team = box_score.teams.home
-                away_team = box_score.teams.away
-
-                games.append(
-                    {
-                        "game_id": game,
-                        "home_team": home_team.team.name,
-                        "home_score": home_team.teamstats["batting"]["runs"],
-                        "home_id": home_team.team.id,
-                        "away_team": away_team.team.name,
-                        "away_score": away_team.teamstats["batting"]["runs"],
-                        "away_id": away_team.team.id,
-                        "date": date,
-                    }
-                )
+        fielding_df = pd.DataFrame(fielder_stats)
+        fielding_df = fielding_df[fielding_df["gamesstarted"] == 1.0].sort_values(
+            by=["name", "date"]
+        )
 
-                home_win = (
-                    home_team.teamstats["batting"]["runs"]
-                    > away_team.teamstats["batting"]["runs"]
-                )
+        games_df = pd.DataFrame(games)
 
-                team_stats.append(
-                    merge_team_stats(home_team, date, game, home_win, True)
-                )
-                team_stats.append(
-                    merge_team_stats(away_team, date, game, not home_win, False)
-                )
+        self.storage.append("games", self.season, games_df, batch)
+        self.storage.append("team", self.season, team_df, batch)
+        self.storage.append("pitching", self.season, pitching_df, batch)
+        self.storage.append("batting", self.season, batter_df, batch)
+        self.storage.append("fielding", self.season, fielding_df, batch)
+        people.save()
 
-                add_player_stats(
-                    home_team,
-                    date,
-                    pitcher_stats,
-                    batter_stats,
-                    fielder_stats,
-                    game,
-                )
-                add_player_stats(
-                    away_team,
-                    date,
-                    pitcher_stats,
-                    batter_stats,
-                    fielder_stats,
-                    game,
-                )
-            else:
-                print("skipped")
+        # Committing the watermark makes the batch visible to the next run
+        self.watermark.commit(batch, games_df["game_id"], games_df["date"])
+        print(f"Committed batch {batch} ({len(games)} games)")
 
-        team_df, pitching_df, batter_df, fielding_df, games_df = (
-            self.concatenate_existing_data(
-                team_stats, pitcher_stats, batter_stats, fielder_stats, games
-            )
-        )
+    def fetch_batch(self, pending):
+        team_stats = []
+        pitcher_stats = []
+        batter_stats = []
+        fielder_stats = []
+        games = []
 
-        team_df = team_df.sort_values(by=["date"])
+        box_scores = list(self.fetch_box_scores(pending))
+
+        # Look up handedness for every player in the fetched games in a few
+        # batched requests instead of one request per player appearance
+        call_with_retries(
+            people.warm,
+            [
+                player_id
+                for box_score in box_scores
+                if box_score is not None
+                for player_id in box_score_player_ids(box_score)
+            ],
+            retries=self.retries,
+            backoff=self.backoff,
+        )
 
-        pitching_df = pitching_df.sort_values(by=["name", "date"])
+        for (game, date), box_score in zip(pending, box_scores):
+            if box_score is None:
+                print(f"No box score for {game}")
+                self.watermark.skip(game, date)
+                continue
+            self.add_box_score(
+                box_score,
+                game,
+                date,
+                team_stats,
+                pitcher_stats,
+                batter_stats,
+                fielder_stats,
+                games,
+            )
 
-        batter_df = batter_df[batter_df["atbats"] > 0].sort_values(by=["name", "date"])
+        if games:
+            self.save_batch(
+                self.watermark.next_batch(),
+                team_stats,
+                pitcher_stats,
+                batter_stats,
+                fielder_stats,
+                games,
+            )
 
-        fielding_df = fielding_df[fielding_df["gamesstarted"] == 1.0].sort_values(
-            by=["name", "date"]
-        )
+    def fetch_stats(self):
+        pending = {}
+        skipped = 0
+        for game, date in self.get_season_games():
+            if game in pending:
+                continue
+            if not self.use_existing or not self.data_exists(game):
+                pending[game] = date
+            else:
+                skipped += 1
+        print(f"Skipped {skipped} existing games")
 
-        return games_df, team_df, pitching_df, batter_df, fielding_df
+        # Process games in date/gamePk order regardless of completion order
+        pending = sorted(pending.items(), key=lambda item: (str(item[1]), item[0]))
+        for start in range(0, len(pending), self.batch_size):
+            print(f"{start} / {len(pending)}")
+            self.fetch_batch(pending[start : start + self.batch_size])
 
     def fetch_and_save_data(self):
         self.find_existing_data()
-        gdf, tdf, pdf, bdf, fdf = self.fetch_stats()
-        gdf.to_csv(f"{self.season}_games.csv", index=False)
-        print("saved game data")
-        tdf.to_csv(f"{self.season}_team_stats.csv", index=False)
-        print("saved team data")
-        pdf.to_csv(f"{self.season}_pitching_stats.csv", index=False)
-        print("saved pitching data")
-        bdf.to_csv(f"{self.season}_batting_stats.csv", index=False)
-        print("saved batting data")
-        fdf.to_csv(f"{self.season}_fielding_stats.csv", index=False)
-        print("saved fielding data")
+        self.fetch_stats()
+        self.watermark.save()
+
+
+def fetch_season(season, args):
+    # Module level so it can run in a worker process, each season writes its
+    # own storage partition and watermark
+    DataFetcher(
+        season,
+        use_existing=not args.new,
+        workers=args.workers,
+        retries=args.retries,
+        cache=ResponseCache(args.cache_dir, offline=args.offline),
+        storage=get_storage(args.storage, args.data_dir),
+        batch_size=args.batch_size,
+    )
 
 
 if __name__ == "__main__":
@@ -315,8 +321,82 @@ if __name__ == "__main__":
         default=False,
     )
 
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of box scores to download concurrently",
+        type=int,
+        default=8,
+    )
+
+    parser.add_argument(
+        "-r",
+        "--retries",
+        help="Attempts per API request before giving up",
+        type=int,
+        default=3,
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory holding cached raw API responses",
+        default="cache",
+    )
+
+    parser.add_argument(
+        "--offline",
+        help="Serve box scores and schedules from the response cache only",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--storage",
+        help="Backend used to store the per-season tables",
+        choices=["parquet", "csv"],
+        default="parquet",
+    )
+
+    parser.add_argument(
+        "--data-dir",
+        help="Root directory of the stored tables",
+        default=None,
+    )
+
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        help="Games fetched and committed to storage per batch",
+        type=int,
+        default=100,
+    )
+
+    parser.add_argument(
+        "-s",
+        "--seasons",
+        help="Seasons to fetch",
+        type=int,
+        nargs="+",
+        default=[2022],
+    )
+
+    parser.add_argument(
+        "-p",
+        "--processes",
+        help="Number of seasons to backfill in parallel worker processes",
+        type=int,
+        default=1,
+    )
+
     args = parser.parse_known_args()[0]
 
-    seasons = [2022]
-    for season in seasons:
-        DataFetcher(season, use_existing=not args.new)
+    if args.processes > 1 and len(args.seasons) > 1:
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            futures = [
+                executor.submit(fetch_season, season, args) for season in args.seasons
+            ]
+            for future in futures:
+                future.result()
+    else:
+        for season in args.seasons:
+            fetch_season(season, args)
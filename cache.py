@@ -0,0 +1,107 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from atomicfile import atomic_write
+from mlbstatsapi.mlb_dataadapter import MlbDataAdapter
+from mlbstatsapi.models.game import BoxScore
+from mlbstatsapi.models.schedules import Schedule
+
+
+def schedule_is_final(payload):
+    # A schedule only stops changing once every game in it is final
+    # (postponed and cancelled games are reported as final too)
+    return all(
+        game["status"]["abstractgamestate"] == "Final"
+        for day in payload.get("dates", [])
+        for game in day["games"]
+    )
+
+
+class ResponseCache:
+    """
+    Local cache of the raw (key-lowercased) payloads that mlbstatsapi turns into
+    BoxScore and Schedule objects. Entries are gzipped JSON files, box scores are
+    keyed by gamePk and schedules by a hash of their request parameters. Final
+    payloads are kept forever, anything else expires after live_ttl seconds.
+    """
+
+    def __init__(self, directory="cache", live_ttl=600, offline=False, adapter=None):
+        self.directory = directory
+        self.live_ttl = live_ttl
+        self.offline = offline
+        self.adapter = adapter or MlbDataAdapter()
+
+    def path(self, kind, key):
+        return os.path.join(self.directory, kind, f"{key}.json.gz")
+
+    def load(self, kind, key):
+        try:
+            with gzip.open(self.path(kind, key), "rt") as file:
+                entry = json.load(file)
+        except (OSError, EOFError, ValueError):
+            return None
+
+        expired = time.time() - entry["fetched"] > self.live_ttl
+        if not entry["final"] and expired and not self.offline:
+            return None
+        return entry["payload"]
+
+    def store(self, kind, key, payload, final):
+        with atomic_write(self.path(kind, key)) as tmp_path:
+            with gzip.open(tmp_path, "wt") as file:
+                entry = {"final": final, "fetched": time.time(), "payload": payload}
+                json.dump(entry, file)
+
+    def get(self, kind, key, endpoint, params, is_final):
+        payload = self.load(kind, key)
+        if payload is not None:
+            return payload
+        if self.offline:
+            print(f"{kind} {key} is not cached")
+            return None
+
+        result = self.adapter.get(endpoint=endpoint, ep_params=params)
+        if 400 <= result.status_code <= 499:
+            return None
+        self.store(kind, key, result.data, is_final(result.data))
+        return result.data
+
+    def get_box_score(self, game_pk, final=True):
+        payload = self.get(
+            "boxscore",
+            game_pk,
+            f"game/{game_pk}/boxscore",
+            {},
+            lambda payload: final,
+        )
+        if payload and payload.get("teams"):
+            return BoxScore(**payload)
+
+    def get_schedule(self, start_date, end_date, game_types, sport_id=1):
+        if not isinstance(game_types, str):
+            game_types = ",".join(game_types)
+        params = {
+            "startDate": str(start_date),
+            "endDate": str(end_date),
+            "gameTypes": game_types,
+            "sportId": sport_id,
+        }
+        key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        payload = self.get("schedule", key, "schedule", params, schedule_is_final)
+        if payload and payload.get("dates"):
+            return Schedule(**payload)
+
+    def get_teams(self, sport_id=1):
+        payload = self.get(
+            "teams",
+            sport_id,
+            "teams",
+            {"sportId": sport_id},
+            lambda payload: True,
+        )
+        if payload:
+            return payload.get("teams", [])
+        return []
@@ -13,72 +13,110 @@ def load_rosters():
         return rosters
 
 
-def get_player_stats(p, player_id, pitching, batting, fielding):
-    if pitching:
-        pitching_df = p.pitching_data[p.pitching_data["player_id"] == player_id]
-        recent_stats = pitching_df.sort_values(by="date", ascending=False).head(1)
-        return recent_stats
-    if batting:
-        batting_df = p.batting_data[p.batting_data["player_id"] == player_id]
-        recent_stats = batting_df.sort_values(by="date", ascending=False).head(1)
-        return recent_stats
-    if fielding:
-        fielding_df = p.fielding_data[p.fielding_data["player_id"] == player_id]
-        recent_stats = fielding_df.sort_values(by="date", ascending=False).head(1)
-        return recent_stats
+# Columns of a player's stats that aren't copied into the game profile
+NONSTAT_COLUMNS = [
+    "player_id",
+    "date",
+    "name",
+    "position",
+    "game_id",
+    "team_id",
+    "battingorder",
+]
 
 
-def add_stats_to_dict(prefix, stats, dict, home_or_away):
-    for i, r in stats.iterrows():
-        for col in stats.columns:
-            if col not in [
-                "player_id",
-                "date",
-                "name",
-                "position",
-                "game_id",
-                "team_id",
-                "battingorder",
-            ]:
-
-                dict[f"{prefix}_{col}_{home_or_away}"] = r[col]
+def latest_player_stats(p):
+    """
+    Most recent row of every player in each stat family, indexed by player_id.
+    """
+    latest = {}
+    for family, data in [
+        ("pitching", p.pitching_data),
+        ("batting", p.batting_data),
+        ("fielding", p.fielding_data),
+    ]:
+        latest[family] = (
+            data.sort_values(by=["date", "game_id"], kind="stable")
+            .drop_duplicates("player_id", keep="last")
+            .set_index("player_id")
+        )
+    return latest
 
 
-def generate_full_rosters(rosters, p):
-    games = []
-    for game in rosters:
+def lineup_slots(rosters):
+    # One row per player slot on the slate, in profile column order
+    slots = []
+    for game_index, game in enumerate(rosters):
         if "home_1" not in game:
             continue
-        game_dict = {}
-        away_pitcher_stats = get_player_stats(
-            p, game["away_pitcher_id"], True, False, False
-        )
-        home_pitcher_stats = get_player_stats(
-            p, game["home_pitcher_id"], True, False, False
-        )
-        add_stats_to_dict("SP", away_pitcher_stats, game_dict, "away")
-        add_stats_to_dict("SP", home_pitcher_stats, game_dict, "home")
+        for side in ["away", "home"]:
+            slots.append(
+                (game_index, "pitching", "SP", side, game[f"{side}_pitcher_id"])
+            )
         for i in range(1, 10):
+            for side in ["home", "away"]:
+                slots.append(
+                    (
+                        game_index,
+                        "batting",
+                        f"batter_{i}",
+                        side,
+                        game[f"{side}_{i}"]["id"],
+                    )
+                )
+            for side in ["home", "away"]:
+                slots.append(
+                    (
+                        game_index,
+                        "fielding",
+                        f"fielder_{game[f'{side}_{i}']['position']}",
+                        side,
+                        game[f"{side}_{i}"]["id"],
+                    )
+                )
+    return pd.DataFrame(
+        slots, columns=["game", "family", "prefix", "side", "player_id"]
+    )
 
-            home_player_id = game[f"home_{i}"]["id"]
-            away_player_id = game[f"away_{i}"]["id"]
-            home_position = game[f"home_{i}"]["position"]
-            away_position = game[f"away_{i}"]["position"]
-            home_batter_stats = get_player_stats(p, home_player_id, False, True, False)
-            away_batter_stats = get_player_stats(p, away_player_id, False, True, False)
-            home_fielder_stats = get_player_stats(p, home_player_id, False, False, True)
-            away_fielder_stats = get_player_stats(p, away_player_id, False, False, True)
-            add_stats_to_dict(f"batter_{i}", home_batter_stats, game_dict, "home")
-            add_stats_to_dict(f"batter_{i}", away_batter_stats, game_dict, "away")
-            add_stats_to_dict(
-                f"fielder_{home_position}", home_fielder_stats, game_dict, "home"
-            )
-            add_stats_to_dict(
-                f"fielder_{away_position}", away_fielder_stats, game_dict, "away"
-            )
 
-        games.append(game_dict)
-    game_profiles = pd.DataFrame(games)
+def generate_full_rosters(rosters, p):
+    latest = latest_player_stats(p)
+    slots = lineup_slots(rosters)
+    games = [i for i, game in enumerate(rosters) if "home_1" in game]
+
+    # Join every slot of a stat family with the latest stats at once, then
+    # spread the slots out to {prefix}_{stat}_{side} columns
+    stat_columns = {}
+    blocks = [pd.DataFrame(index=games)]
+    found = []
+    for family, family_slots in slots.groupby("family", sort=False):
+        stats = latest[family]
+        stat_columns[family] = [
+            col for col in stats.columns if col not in NONSTAT_COLUMNS
+        ]
+        joined = family_slots.join(
+            stats[stat_columns[family]], on="player_id", how="inner"
+        )
+        # A later slot with the same prefix and side replaces an earlier one
+        found.append(joined[["family", "prefix", "side"]])
+        joined = joined.drop_duplicates(["game", "prefix", "side"], keep="last")
+        wide = joined.set_index(["game", "prefix", "side"])[
+            stat_columns[family]
+        ].unstack(["prefix", "side"])
+        wide.columns = [f"{prefix}_{col}_{side}" for col, prefix, side in wide.columns]
+        blocks.append(wide)
+    game_profiles = pd.concat(blocks, axis=1)
+
+    # Columns in the order their slot is first filled on the slate
+    columns = []
+    if found:
+        found = pd.concat(found).sort_index().drop_duplicates()
+        columns = [
+            f"{prefix}_{col}_{side}"
+            for family, prefix, side in found.itertuples(index=False)
+            for col in stat_columns[family]
+        ]
+    game_profiles = game_profiles[columns].reindex(games).reset_index(drop=True)
     game_profiles.to_csv("game_profiles.csv")
     return game_profiles
 
@@ -86,5 +124,5 @@ def generate_full_rosters(rosters, p):
 if __name__ == "__main__":
     subprocess.run(["python", "rosters.py"])
     rosters = load_rosters()
-    p = Preprocessor([2024], 50, 0, False)
+    p = Preprocessor([2024], 50, 0, False, current=True)
     print(generate_full_rosters(rosters, p))
@@ -0,0 +1,107 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from atomicfile import atomic_write
+
+KEY_COLUMNS = ["game_id", "team_id", "date"]
+LABEL_COLUMNS = ["win"]
+
+# Feature columns converted to float32 at a time, bounds the temporary copy
+BLOCK_COLUMNS = 256
+
+
+def feature_columns(profiles):
+    return [
+        col
+        for col in profiles.columns
+        if col not in KEY_COLUMNS + LABEL_COLUMNS
+        and not col.startswith("Unnamed")
+        and (
+            pd.api.types.is_numeric_dtype(profiles[col])
+            or pd.api.types.is_bool_dtype(profiles[col])
+        )
+    ]
+
+
+def export_feature_matrix(profiles, directory):
+    """
+    Write complete profiles as a float32 row-major features.npy and a
+    manifest.json naming its columns, with the game_id, team_id and date of
+    every row and the labels. Text columns are left out. The manifest is
+    written last, a directory without one holds an unfinished export.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    profiles = profiles.sort_values(by=KEY_COLUMNS, kind="stable").reset_index(
+        drop=True
+    )
+    columns = feature_columns(profiles)
+    matrix = np.lib.format.open_memmap(
+        os.path.join(directory, "features.npy"),
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(profiles), len(columns)),
+    )
+    for start in range(0, len(columns), BLOCK_COLUMNS):
+        block = columns[start : start + BLOCK_COLUMNS]
+        matrix[:, start : start + len(block)] = profiles[block].to_numpy(
+            dtype=np.float32
+        )
+    matrix.flush()
+    del matrix
+
+    manifest = {
+        "file": "features.npy",
+        "dtype": "float32",
+        "shape": [len(profiles), len(columns)],
+        "columns": columns,
+        "keys": {
+            "game_id": profiles["game_id"].astype(int).tolist(),
+            "team_id": profiles["team_id"].astype(int).tolist(),
+            "date": pd.to_datetime(profiles["date"]).dt.strftime("%Y-%m-%d").tolist(),
+        },
+        "labels": {
+            col: profiles[col].astype(int).tolist()
+            for col in LABEL_COLUMNS
+            if col in profiles.columns
+        },
+    }
+    with atomic_write(manifest_path) as tmp_path, open(tmp_path, "w") as file:
+        json.dump(manifest, file)
+    print(f"Exported {len(profiles)} rows of {len(columns)} features to {directory}")
+
+
+def load_feature_matrix(directory):
+    """
+    The exported matrix, memory-mapped read-only, and its manifest. Slicing the
+    matrix only reads the rows and columns asked for.
+    """
+    with open(os.path.join(directory, "manifest.json"), "r") as file:
+        manifest = json.load(file)
+    matrix = np.load(os.path.join(directory, manifest["file"]), mmap_mode="r")
+    return matrix, manifest
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="featurematrix")
+    parser.add_argument(
+        "profiles",
+        help="complete_profiles.csv of an earlier build",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Directory the matrix and manifest are written to",
+        default="feature_matrix",
+    )
+    args = parser.parse_args()
+
+    export_feature_matrix(pd.read_csv(args.profiles, low_memory=False), args.output)
@@ -0,0 +1,169 @@
+import glob
+import json
+import os
+import shutil
+
+import pandas as pd
+
+from atomicfile import atomic_write
+from watermark import Watermark
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+# Version of what a store keeps, bumped whenever rows or state written by
+# earlier code would be read differently. 2: player tails hold innings pitched
+# already converted to true innings. Stores without a format file are 1.
+FORMAT_VERSION = 2
+
+FEATURE_TABLES = [
+    "team_data",
+    "batting_data",
+    "pitching_data",
+    "fielding_data",
+    "rosters",
+    "complete_profiles",
+]
+
+
+def storable(df):
+    # Text columns hold str or None, the same as storage.apply_schema
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if values.dtype == object:
+            columns[col] = values.astype(str).where(values.notna(), None)
+        else:
+            columns[col] = values
+    return pd.DataFrame(columns, index=df.index).reset_index(drop=True)
+
+
+def write_parquet(df, path):
+    with atomic_write(path) as tmp_path:
+        storable(df).to_parquet(tmp_path, index=False)
+
+
+class FeatureStore:
+    """
+    Preprocessor output kept between runs so only new games are processed, under
+    {root}/span={span}_shift={shift}/. Every run appends the rows of its new
+    games to each table as part-{batch}.parquet. state/batch-{batch}/ holds what
+    the next run needs to continue every player: their last span + shift raw
+    rows and the EWM state from before those rows. Saving the watermark commits
+    a run, parts and state of uncommitted batches are discarded. A store written
+    in another FORMAT_VERSION is refused rather than continued, and so is a
+    store of another data root or seasons earlier than its own.
+    """
+
+    def __init__(self, root="features", span=50, shift=1):
+        if pq is None:
+            raise ImportError("The feature store requires pyarrow")
+        self.root = os.path.join(root, f"span={span}_shift={shift}")
+        self.watermark = Watermark(os.path.join(self.root, "watermark.json"))
+        self.check_format()
+
+    def format_path(self):
+        return os.path.join(self.root, "format.json")
+
+    def read_format(self):
+        try:
+            with open(self.format_path(), "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {"version": 1}
+
+    def check_format(self):
+        if self.watermark.empty():
+            return
+        version = self.read_format()["version"]
+        if version != FORMAT_VERSION:
+            raise ValueError(
+                f"Feature store {self.root} has format {version}, this version "
+                f"reads format {FORMAT_VERSION}. Remove it to rebuild."
+            )
+
+    def table_dir(self, table):
+        return os.path.join(self.root, table)
+
+    def state_dir(self, batch):
+        return os.path.join(self.root, "state", f"batch-{batch:05d}")
+
+    def files(self, table):
+        return sorted(glob.glob(os.path.join(self.table_dir(table), "part-*.parquet")))
+
+    def read(self, table, columns=None):
+        frames = []
+        for file in self.files(table):
+            file_columns = None
+            if columns is not None:
+                names = set(pq.read_schema(file).names)
+                file_columns = [col for col in columns if col in names]
+            frames.append(pd.read_parquet(file, columns=file_columns))
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def append(self, batch, tables):
+        for table, df in tables.items():
+            if not df.empty:
+                write_parquet(
+                    df, os.path.join(self.table_dir(table), f"part-{batch:05d}.parquet")
+                )
+
+    def read_state(self):
+        state = {}
+        state_dir = self.state_dir(max(self.watermark.batches))
+        for path in glob.glob(os.path.join(state_dir, "*.parquet")):
+            state[os.path.basename(path)[: -len(".parquet")]] = pd.read_parquet(path)
+        return state
+
+    def save_state(self, batch, state):
+        for name, df in state.items():
+            write_parquet(df, os.path.join(self.state_dir(batch), f"{name}.parquet"))
+
+    def check_source(self, seasons, data_root):
+        # Rows only ever go after the ones already stored, earlier seasons or
+        # another data source can't be added
+        built = self.read_format()
+        if self.watermark.empty() or "seasons" not in built:
+            return
+        if os.path.abspath(data_root) != built["data_root"]:
+            raise ValueError(
+                f"Feature store {self.root} was built from {built['data_root']}, "
+                f"not {os.path.abspath(data_root)}"
+            )
+        if min(seasons) < min(built["seasons"]):
+            raise ValueError(
+                f"Feature store {self.root} starts at {min(built['seasons'])}, "
+                f"rebuild it to add {min(seasons)}"
+            )
+
+    def commit(self, batch, game_ids, dates, seasons, data_root):
+        built = self.read_format()
+        with atomic_write(self.format_path()) as tmp_path:
+            with open(tmp_path, "w") as file:
+                json.dump(
+                    {
+                        "version": FORMAT_VERSION,
+                        "seasons": sorted(set(built.get("seasons", [])) | set(seasons)),
+                        "data_root": os.path.abspath(data_root),
+                    },
+                    file,
+                )
+        self.watermark.commit(batch, game_ids, dates)
+        # Runs only continue from the latest state
+        for path in glob.glob(os.path.join(self.root, "state", "batch-*")):
+            if path != self.state_dir(batch):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def rollback(self):
+        for path in glob.glob(os.path.join(self.root, "*", "part-*")):
+            batch = int(os.path.basename(path)[5:10])
+            if path.endswith(".tmp") or batch not in self.watermark.batches:
+                os.remove(path)
+        for path in glob.glob(os.path.join(self.root, "state", "batch-*")):
+            if int(path[-5:]) not in self.watermark.batches:
+                shutil.rmtree(path, ignore_errors=True)
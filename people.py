@@ -0,0 +1,67 @@
+import json
+
+from atomicfile import atomic_write
+from mlbstatsapi.mlb_dataadapter import MlbDataAdapter
+
+UNKNOWN_PERSON = {"name": None, "batside": None, "pitchhand": None}
+
+
+class PeopleStore:
+    """
+    Persistent player_id -> {name, batside, pitchhand} lookup. Unknown players are
+    fetched from the people endpoint in batches of batch_size ids per request.
+    Offline, unknown players get None fields and nothing is requested or saved
+    for them.
+    """
+
+    def __init__(self, path="people.json", adapter=None, batch_size=100, offline=False):
+        self.path = path
+        self.adapter = adapter or MlbDataAdapter()
+        self.batch_size = batch_size
+        self.offline = offline
+        self.people = self.read()
+        self.dirty = False
+
+    def read(self):
+        try:
+            with open(self.path, "r") as file:
+                return {int(k): v for k, v in json.load(file).items()}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save(self):
+        if not self.dirty:
+            return
+        # Merge with entries written by other processes since we loaded
+        people = self.read()
+        people.update(self.people)
+        with atomic_write(self.path) as tmp_path, open(tmp_path, "w") as file:
+            json.dump(people, file)
+        self.people = people
+        self.dirty = False
+
+    def warm(self, player_ids):
+        if self.offline:
+            return
+        missing = sorted({int(p) for p in player_ids} - self.people.keys())
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i : i + self.batch_size]
+            result = self.adapter.get(
+                endpoint="people",
+                ep_params={"personIds": ",".join(str(p) for p in batch)},
+            )
+            for person in result.data.get("people", []):
+                self.people[person["id"]] = {
+                    "name": person.get("fullname"),
+                    "batside": person.get("batside", {}).get("code"),
+                    "pitchhand": person.get("pitchhand", {}).get("code"),
+                }
+            # Remember ids the API doesn't know so they aren't requested again
+            for player_id in batch:
+                self.people.setdefault(player_id, dict(UNKNOWN_PERSON))
+            self.dirty = True
+
+    def get(self, player_id):
+        if player_id not in self.people:
+            self.warm([player_id])
+        return self.people.get(player_id, UNKNOWN_PERSON)
@@ -1,7 +1,16 @@
+import os
+import tempfile
+
 import pandas as pd
 import numpy as np
+from storage import get_storage
 from statutil import (
     convert_innings_pitched,
+    ewm_mean,
+    ewm_state,
+    rolling_mean,
+    rolling_sum,
+    signed_streak,
     reconstruct_lost_pitching_stats,
     reconstruct_lost_team_stats,
     reconstruct_lost_fielding_stats,
@@ -9,25 +18,214 @@ from statutil import (
 )
 
 import warnings
-from pandas.errors import PerformanceWarning
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
 
 warnings.filterwarnings("ignore", category=UserWarning, module="pandas")
-warnings.filterwarnings("ignore", category=PerformanceWarning, module="pandas")
+
+PLAYER_TABLES = ["batting", "pitching", "fielding"]
+
+ROSTER_KEYS = ["game_id", "team_id"]
+
+# Player columns left out of the wide roster profiles
+NONSTAT_COLUMNS = [
+    "game_id",
+    "team_id",
+    "battingorder",
+    "date",
+    "player_id",
+    "name",
+    "position",
+]
+PITCHER_NONSTAT_COLUMNS = [
+    "game_id",
+    "team_id",
+    "gamesstarted",
+    "date",
+    "player_id",
+    "name",
+]
+
+# Text columns identifying a player's handedness, carried through unaveraged
+HANDEDNESS_COLUMNS = ["batside", "pitchhand"]
+
+# Team rate stats, rebuilt from rolling sums by reconstruct_lost_team_stats
+TEAM_RATE_COLUMNS = [
+    "batting_avg",
+    "batting_obp",
+    "batting_slg",
+    "batting_ops",
+    "batting_stolenbasepercentage",
+    "batting_atbatsperhomerun",
+    "fielding_stolenbasepercentage",
+    "pitching_obp",
+    "pitching_stolenbasepercentage",
+    "pitching_era",
+    "pitching_whip",
+    "pitching_groundoutstoairouts",
+    "pitching_strikepercentage",
+]
+
+
+# Columns of each table that are not averaged
+NON_AVERAGED_COLUMNS = {
+    "team": [
+        "teamCode",
+        "team_id",
+        "name",
+        "home",
+        "game_id",
+        "date",
+        "win",
+        "game_count",
+        "time_between_games",
+        "playoff",
+    ]
+    + TEAM_RATE_COLUMNS,
+    "pitching": [
+        "game_id",
+        "player_id",
+        "team_id",
+        "name",
+        "date",
+        "gamesstarted",
+        "position",
+        "summary",
+        "note",
+        "stolenbasepercentage",
+        "strikepercentage",
+        "runsscoredper9",
+        "homerunsper9",
+        "atbats",
+        "position",
+        "battingorder",
+    ]
+    + HANDEDNESS_COLUMNS,
+    "fielding": [
+        "game_id",
+        "player_id",
+        "team_id",
+        "name",
+        "date",
+        "position",
+        "stolenbasepercentage",
+        "battingorder",
+    ]
+    + HANDEDNESS_COLUMNS,
+    "batting": [
+        "game_id",
+        "player_id",
+        "team_id",
+        "summary",
+        "note",
+        "name",
+        "date",
+        "position",
+        "stolenbasepercentage",
+        "atbatsperhomerun",
+        "atbats",
+        "battingorder",
+    ]
+    + HANDEDNESS_COLUMNS,
+}
+
+
+# Stored columns no feature stage reads, left out when the tables are loaded
+UNUSED_COLUMNS = {
+    "team": TEAM_RATE_COLUMNS,
+    "pitching": [
+        "stolenbasepercentage",
+        "strikepercentage",
+        "runsscoredper9",
+        "homerunsper9",
+        "summary",
+        "note",
+        "position",
+        "battingorder",
+    ],
+    "fielding": ["stolenbasepercentage"],
+    "batting": [
+        "stolenbasepercentage",
+        "summary",
+        "note",
+        "atbatsperhomerun",
+    ],
+}
+
+
+# Innings pitched columns, converted to true innings when a table is read
+INNINGS_COLUMNS = {
+    "team": ["pitching_inningspitched"],
+    "pitching": ["inningspitched"],
+    "fielding": [],
+    "batting": [],
+}
+
+
+def select_averaging_columns(table, columns):
+    return [
+        col
+        for col in columns
+        if col not in NON_AVERAGED_COLUMNS[table]
+        and "running" not in col
+        and "rolling" not in col
+    ]
+
+
+def fill_missing(data):
+    # Missing values become 0, except in categorical columns where 0 isn't
+    # one of the categories
+    return data.fillna(
+        {
+            col: 0
+            for col in data.columns
+            if not isinstance(data[col].dtype, pd.CategoricalDtype)
+        }
+    )
 
 
 class Preprocessor:
 
-    def __init__(self, seasons, span, shift, full):
+    def __init__(
+        self,
+        seasons,
+        span,
+        shift,
+        full,
+        storage=None,
+        workers=1,
+        features=None,
+        current=False,
+        load=True,
+    ):
 
         self.seasons = seasons
+        self.storage = storage or get_storage()
         self.span = span
         self.shift = shift
         self.full = full
+        self.workers = workers
+        # Without load only the feature methods are usable, as in the
+        # player_features workers
+        if not load:
+            return
+        if features is not None:
+            self.features = features
+            self.update_features()
+            return
+        if current:
+            self.load_current_profiles()
+            return
+
         self.games = self.load_games()
         self.team_data = self.load_team_data()
         if self.full:
-            self.team_data.to_csv("team_data.csv")
-            del self.team_data
+            self.spill_team_data()
         self.load_player_data()
 
         if self.full:
@@ -35,666 +233,796 @@ class Preprocessor:
 
             self.save_data()
 
-    def load_games(self):
-        seasons = []
-        for season in self.seasons:
-            seasons.append(pd.read_csv(f"{season}_games.csv"))
-        return pd.concat(seasons)
-
-    def load_team_data(self):
-        modified_groups = []
-        for season in self.seasons:
-            team_df = pd.read_csv(f"{season}_team_stats.csv").fillna(0)
-            # Calculate statistics for each season
-            ## Game count, time between games, running averages, winning percentages, streaks
-            grouped = team_df.groupby("teamCode")
-            for name, group in grouped:
-                group["game_count"] = (
-                    group["game_id"].expanding().count().shift(self.shift).fillna(0)
-                )
-                group["date"] = pd.to_datetime(group["date"])
-                group["time_between_games"] = group["date"].diff().dt.days
-                group["playoff"] = (group["game_count"] > 162).astype(int)
-
-                group["pitching_inningspitched"] = convert_innings_pitched(
-                    group["pitching_inningspitched"]
-                )
-
-                print("Generating team data")
-                group = self.generate_team_running_averages(group)
-                group = self.generate_winning_percentages(group)
-                group = self.generate_streak(group)
-
-                modified_groups.append(group)
+    def load_current_profiles(self):
+        # Latest row of every player and team. Players use their last span + shift
+        # rows and an EWM seed for the older ones
+        window = self.span + self.shift
+        for table, data in self.read_player_tables().items():
+            data = self.sort_players(data)
+            from_end = data.groupby("player_id").cumcount(ascending=False)
+            seeds = None
+            if table == "fielding":
+                seeds = self.ewm_seeds(data[from_end >= window])
+            features = self.player_features(table, data[from_end < window], seeds)
+            features = features.drop_duplicates(["player_id", "game_id"])
+            setattr(
+                self,
+                f"{table}_data",
+                features.drop_duplicates("player_id", keep="last").reset_index(
+                    drop=True
+                ),
+            )
 
-        # Concatenate team data
-        return pd.concat(modified_groups).fillna(0)
+        team_df = self.team_features(self.read_table("team", [max(self.seasons)]))
+        self.team_data = team_df.drop_duplicates("teamCode", keep="last").reset_index(
+            drop=True
+        )
 
-    def generate_winning_percentages(self, group):
-        # Calculate overall winning percentage
+    def ewm_seeds(self, rows):
+        # EWM state of each player's fielding rows in closed form, the k-th row
+        # from the end carries a weight of decay ** k
+        columns = select_averaging_columns("fielding", rows.columns)
+        stats = rows[columns].fillna(0)
+        from_end = rows.groupby("player_id").cumcount(ascending=False)
+        seeds = {}
         for span_factor in [1, 2, 10]:
-            col_name = f"winning_percentage_last_{int(self.span/span_factor)}"
-            group[col_name] = (
-                group["win"]
-                .rolling(window=int(self.span / span_factor), min_periods=1)
-                .mean()
-                .shift(self.shift)
-            )
-
-            # Calculate winning percentage for away and away games
-            home_games = group[group["home"] == True]
-            home_games[f"home_{col_name}"] = (
-                home_games["win"]
-                .rolling(window=int(self.span / span_factor), min_periods=0)
-                .mean()
+            span = int(self.span / span_factor)
+            weight = (1 - 2 / (span + 1)) ** from_end
+            total = weight.groupby(rows["player_id"]).sum()
+            seeds[span] = (
+                stats.mul(weight, axis=0)
+                .groupby(rows["player_id"])
+                .sum()
+                .div(total, axis=0)
+                .assign(weight=total)
             )
-
-            away_games = group[group["home"] == False]
-            away_games[f"away_{col_name}"] = (
-                away_games["win"]
-                .rolling(window=int(self.span / span_factor), min_periods=0)
-                .mean()
+        return seeds
+
+    def update_features(self):
+        # Builds only the games the feature store hasn't seen, one committed batch
+        # per season
+        store = self.features
+        store.rollback()
+        store.check_source(self.seasons, self.storage.root)
+        games = self.load_games()
+        stored = games["game_id"].isin(store.watermark.game_ids)
+        games, stored = games[~stored], games[stored]
+        if games.empty:
+            print("Features are up to date")
+            return
+
+        # Player tails only hold games up to the last stored one, a game dated
+        # before it would be built on later games and leave stored rows stale
+        stored_keys = list(zip(stored["date"], stored["game_id"]))
+        if store.watermark.last_date:
+            stored_keys.append((store.watermark.last_date, 0))
+        last = max(stored_keys, default=None)
+        late = [
+            game
+            for game in zip(games["date"], games["game_id"])
+            if last is not None and game < last
+        ]
+        if late:
+            raise ValueError(
+                f"{len(late)} new games, the first {late[0][1]} on {late[0][0]}, "
+                f"come before the store's last game on {last[0]}. Rebuild the "
+                "feature store to include them."
             )
 
-            # Merge back the calculated home and away percentages to the main dataframe
-            group = group.merge(
-                home_games[["game_id", f"home_{col_name}"]], on="game_id", how="left"
+        state = store.read_state()
+        for season, season_games in games.groupby(games["date"].str[:4], sort=True):
+            self.update_season(int(season), season_games, state)
+
+    def update_season(self, season, games, state):
+        store = self.features
+        self.games = games
+        new_games = set(games["game_id"])
+        batch = store.watermark.next_batch()
+        print(f"Updating features for {len(new_games)} games of {season}")
+
+        # Team stats restart every season, only the teams that played are
+        # rebuilt
+        team_df = self.read_table("team", [season])
+        team_codes = team_df["teamCode"].astype(str)
+        played = team_codes[team_df["game_id"].isin(new_games)]
+        team_df = self.team_features(team_df[team_codes.isin(played)])
+        team_df = team_df[team_df["game_id"].isin(new_games)]
+        team_df["date"] = team_df["date"].dt.strftime("%Y-%m-%d")
+        self.team_data = team_df
+
+        # Players continue from their saved tails, only the months holding the
+        # new games are read
+        months = sorted(set(games["date"].str[5:7]))
+        for table in PLAYER_TABLES:
+            print(f"Generating {table} data")
+            data = self.read_table(table, [season], months)
+            data = data[data["game_id"].isin(new_games)].sort_values(
+                by=["date", "game_id"], kind="stable"
             )
-            group = group.merge(
-                away_games[["game_id", f"away_{col_name}"]], on="game_id", how="left"
+            features = self.continue_player_features(table, data, state)
+            setattr(
+                self,
+                f"{table}_data",
+                features[features["game_id"].isin(new_games)].drop_duplicates(
+                    ["player_id", "game_id"]
+                ),
             )
 
-            # Forward fill the NaN values in home and away winning percentages
-            group[f"home_{col_name}"] = (
-                group[f"home_{col_name}"].ffill().shift(self.shift)
-            )
-            group[f"away_{col_name}"] = (
-                group[f"away_{col_name}"].ffill().shift(self.shift)
-            )
+        self.generate_all_rosters()
+        self.complete_profiles = join_profiles(self.team_data, self.rosters)
+
+        store.append(
+            batch,
+            {
+                "team_data": self.team_data,
+                "batting_data": self.batting_data,
+                "pitching_data": self.pitching_data,
+                "fielding_data": self.fielding_data,
+                "rosters": self.rosters,
+                "complete_profiles": self.complete_profiles,
+            },
+        )
+        store.save_state(batch, state)
+        store.commit(batch, new_games, games["date"], [season], self.storage.root)
+
+    def continue_player_features(self, table, new_rows, state):
+        # Features over each player's saved tail plus new_rows, state gets the new
+        # tails
+        spans = [int(self.span / span_factor) for span_factor in [1, 2, 10]]
+        players = new_rows["player_id"].unique()
+        tail = state.get(f"{table}_tail", new_rows.iloc[:0])
+        context = pd.concat(
+            [tail[tail["player_id"].isin(players)], new_rows], ignore_index=True
+        )
+
+        seeds = None
+        if table == "fielding":
+            seeds = {}
+            for span in spans:
+                seed = state.get(f"fielding_ewm_{span}")
+                if seed is None:
+                    seed = pd.DataFrame({"player_id": [], "weight": []})
+                seeds[span] = seed.set_index("player_id")
+
+        features = self.player_features(table, context, seeds)
+
+        # The last span + shift rows of a player are all the rolling windows of
+        # the next run look at
+        context = self.sort_players(context)
+        keep = (
+            context.groupby("player_id").cumcount(ascending=False)
+            < self.span + self.shift
+        )
+        state[f"{table}_tail"] = pd.concat(
+            [tail[~tail["player_id"].isin(players)], context[keep]], ignore_index=True
+        )
+
+        if table == "fielding":
+            # EWM state after the rows that just left the tail
+            prepared = fill_missing(context)
+            columns = select_averaging_columns("fielding", prepared.columns)
+            keys = [prepared["player_id"]]
+            for span in spans:
+                seed = (
+                    seeds[span].reindex(prepared["player_id"]).set_axis(prepared.index)
+                )
+                mean, weight = ewm_state(prepared[columns], span, keys, seed)
+                dropped = mean.assign(weight=weight, player_id=prepared["player_id"])[
+                    ~keep
+                ]
+                last = dropped.groupby("player_id").tail(1).set_index("player_id")
+                old = seeds[span]
+                state[f"fielding_ewm_{span}"] = pd.concat(
+                    [old[~old.index.isin(last.index)], last]
+                ).reset_index()
+
+        return features
 
-            # Fill remaining NaN values with 0 (for the start of the series)
-            group[[f"home_{col_name}", f"away_{col_name}"]] = group[
-                [f"home_{col_name}", f"away_{col_name}"]
-            ].fillna(0)
+    def load_games(self):
+        return self.storage.read("games", self.seasons)
 
-            return group
+    def read_table(self, table, seasons, months=None):
+        # Only the columns the feature stages use, in compact dtypes and with
+        # innings pitched converted, so no later stage converts them again
+        columns = [
+            col
+            for col in self.storage.columns(table, seasons)
+            if col not in UNUSED_COLUMNS[table]
+        ]
+        data = self.storage.read(
+            table, seasons, columns=columns, compact=True, months=months
+        )
+        for col in INNINGS_COLUMNS[table]:
+            if col in data.columns:
+                data[col] = convert_innings_pitched(data[col])
+        return data
 
-    def generate_team_running_averages(self, group):
-        group = group.replace("-.--", 0)
+    def load_team_data(self):
+        return self.team_features(self.read_table("team", self.seasons))
+
+    def team_features(self, team_df):
+        # Batches are appended in date order, but a late or resumed batch
+        # can land after newer games
+        team_df = fill_missing(
+            team_df.sort_values(by=["date", "game_id"], kind="stable").reset_index(
+                drop=True
+            )
+        )
+        team_df["date"] = pd.to_datetime(team_df["date"])
+
+        # Calculate statistics for each team and season
+        ## Game count, time between games, running averages, winning percentages, streaks
+        # teamCode is keyed by its codes, grouping by a categorical would also
+        # visit the teams missing from the rows
+        team_codes = pd.factorize(team_df["teamCode"])[0]
+        keys = [team_df["date"].dt.year, pd.Series(team_codes, index=team_df.index)]
+        grouped = team_df.groupby(keys)
+        team_df["game_count"] = (
+            (grouped.cumcount() + 1.0).groupby(keys).shift(self.shift).fillna(0)
+        )
+        team_df["time_between_games"] = grouped["date"].diff().dt.days
+        team_df["playoff"] = (team_df["game_count"] > 162).astype(int)
+
+        print("Generating team data")
+        team_df = self.generate_team_running_averages(team_df, keys)
+        team_df = self.generate_winning_percentages(team_df, keys)
+        team_df = self.generate_streak(team_df, keys)
+        return fill_missing(team_df)
+
+    def generate_winning_percentages(self, data, keys):
+        win = data["win"].astype(float)
+        is_home = data["home"] == True
+        percentages = {}
         for span_factor in [1, 2, 10]:
-            averaging_columns = [
-                col
-                for col in group.columns
-                if col
-                not in [
-                    "teamCode",
-                    "team_id",
-                    "name",
-                    "home",
-                    "game_id",
-                    "date",
-                    "win",
-                    "game_count",
-                    "time_between_games",
-                    "playoff",
-                    "batting_avg",
-                    "batting_obp",
-                    "batting_slg",
-                    "batting_ops",
-                    "batting_stolenbasepercentage",
-                    "batting_atbatsperhomerun",
-                    "fielding_stolenbasepercentage",
-                    "pitching_obp",
-                    "pitching_stolenbasepercentage",
-                    "pitching_era",
-                    "pitching_whip",
-                    "pitching_groundoutstoairouts",
-                    "pitching_strikepercentage",
-                ]
-                and "running" not in col
-                and "rolling" not in col
-            ]
-            for col in averaging_columns:
-                running_avg_col_name = (
-                    f"running_avg_{col}_last_{int(self.span/span_factor)}"
+            span = int(self.span / span_factor)
+            col_name = f"winning_percentage_last_{span}"
+
+            # Calculate overall winning percentage
+            percentages[col_name] = rolling_mean(win, span, self.shift, keys)
+
+            # Calculate winning percentage for home and away games over that
+            # side's games only, then carry it forward across the other side's
+            for side, is_side in [("home", is_home), ("away", ~is_home)]:
+                side_percentage = pd.Series(np.nan, index=data.index)
+                side_percentage[is_side] = rolling_mean(
+                    win[is_side], span, 0, [key[is_side] for key in keys]
                 )
-                group[running_avg_col_name] = (
-                    group[col]
-                    .ewm(span=int(self.span / span_factor), min_periods=1)
-                    .mean()
+                percentages[f"{side}_{col_name}"] = (
+                    side_percentage.groupby(keys)
+                    .ffill()
+                    .groupby(keys)
                     .shift(self.shift)
+                    .fillna(0)
                 )
-            group = reconstruct_lost_team_stats(
-                group, int(self.span / span_factor), self.shift
-            )
-        group = group.drop(columns=averaging_columns)
-
-        group = group.drop(
-            columns=[
-                "batting_avg",
-                "batting_obp",
-                "batting_slg",
-                "batting_ops",
-                "batting_stolenbasepercentage",
-                "batting_atbatsperhomerun",
-                "fielding_stolenbasepercentage",
-                "pitching_obp",
-                "pitching_stolenbasepercentage",
-                "pitching_era",
-                "pitching_whip",
-                "pitching_groundoutstoairouts",
-                "pitching_strikepercentage",
+
+        return pd.concat([data, pd.DataFrame(percentages, index=data.index)], axis=1)
+
+    def generate_team_running_averages(self, data, keys):
+        averaging_columns = select_averaging_columns("team", data.columns)
+
+        # One grouped EWM over every averaging column per span, the new columns
+        # are collected as blocks and joined once at the end
+        blocks = []
+        for span_factor in [1, 2, 10]:
+            span = int(self.span / span_factor)
+            running_avgs = ewm_mean(data[averaging_columns], span, self.shift, keys)
+            running_avgs.columns = [
+                f"running_avg_{col}_last_{span}" for col in averaging_columns
             ]
+            blocks.append(running_avgs)
+            blocks.append(reconstruct_lost_team_stats(data, span, self.shift, keys))
+
+        data = data.drop(columns=averaging_columns).drop(
+            columns=UNUSED_COLUMNS["team"], errors="ignore"
         )
-        return group
-
-    def calculate_streak(self, group, home_or_away):
-        # Initialize streak column
-
-        group[f"home_streak"] = np.nan
-        current_streak = 0
-
-        # Select only the relevant games
-        relevant_games = group[group["home"] == True]
-
-        # Calculate the streaks
-        for game in relevant_games.itertuples():
-            if current_streak < 1:
-                if game.win:
-                    current_streak = 1
-                else:
-                    current_streak -= 1
-            else:
-                if game.win:
-                    current_streak += 1
-                else:
-                    current_streak = -1
-
-            # Use .at for a more efficient assignment
-            group.at[game.Index, f"home_streak"] = current_streak
-
-        # Shift the streaks to avoid lookahead bias
-        group[f"home_streak"] = (
-            group[f"home_streak"].bfill().shift(self.shift).fillna(current_streak)
-        )
+        return pd.concat([data] + blocks, axis=1)
+
+    def calculate_streak(self, data, keys):
+        # Home and away streaks only count games on that side, rows from the
+        # other side take the streak of the team's next game on this side
+        for side, is_side in [
+            ("home", data["home"] == True),
+            ("away", data["home"] == False),
+        ]:
+            streak = pd.Series(np.nan, index=data.index)
+            streak[is_side] = signed_streak(
+                data.loc[is_side, "win"], [key[is_side] for key in keys]
+            )
 
-        group[f"away_streak"] = np.nan
-        current_streak = 0
-
-        # Select only the relevant games
-        relevant_games = group[group["home"] == False]
-
-        # Calculate the streaks
-        for game in relevant_games.itertuples():
-            if current_streak < 1:
-                if game.win:
-                    current_streak = 1
-                else:
-                    current_streak -= 1
-            else:
-                if game.win:
-                    current_streak += 1
-                else:
-                    current_streak = -1
-
-            # Use .at for a more efficient assignment
-            group.at[game.Index, f"away_streak"] = current_streak
-
-        # Shift the streaks to avoid lookahead bias
-        group[f"away_streak"] = (
-            group[f"away_streak"].bfill().shift(self.shift).fillna(current_streak)
+            # Rows left empty by the shift take the team's final streak
+            final_streak = streak.groupby(keys).transform("last").fillna(0)
+            data[f"{side}_streak"] = (
+                streak.groupby(keys)
+                .bfill()
+                .groupby(keys)
+                .shift(self.shift)
+                .fillna(final_streak)
+            )
+
+        return data
+
+    def generate_streak(self, data, keys):
+        # Streaks run per team and season across the whole team table
+        data["streak"] = (
+            signed_streak(data["win"], keys).groupby(keys).shift(self.shift).fillna(0)
         )
+        data = self.calculate_streak(data, keys)
+        return data
 
-        return group
-
-    def generate_streak(self, group):
-        group["streak"] = 0
-        current_streak = 0
-        for i, row in group.iterrows():
-
-            if current_streak < 1:
-                if row["win"]:
-                    current_streak = 1
-                else:
-                    current_streak -= 1
-            else:
-                if row["win"]:
-                    current_streak += 1
-                else:
-                    current_streak = -1
-
-            group.at[i, "streak"] = current_streak
-        group["streak"] = group["streak"].shift(self.shift).fillna(0)
-        group = self.calculate_streak(group, True)
-        group = self.calculate_streak(group, False)
-        return group
+    def read_player_tables(self):
+        # Merge all years of data
+        tables = {}
+        for table in PLAYER_TABLES:
+            tables[table] = self.read_table(table, self.seasons).sort_values(
+                by=["date", "game_id"], kind="stable"
+            )
+        return tables
 
     def load_player_data(self):
+        tables = self.read_player_tables()
 
-        # Merge all years of data
-        pitching_data = []
-        fielding_data = []
-        batting_data = []
-        for season in self.seasons:
-            pitching_data.append(pd.read_csv(f"{season}_pitching_stats.csv"))
-            fielding_data.append(pd.read_csv(f"{season}_fielding_stats.csv"))
-            batting_data.append(pd.read_csv(f"{season}_batting_stats.csv"))
-        merged_pitching_stats = (
-            pd.concat(pitching_data).sort_values(by=["date"]).fillna(0)
-        )
-        merged_fielding_stats = (
-            pd.concat(fielding_data).sort_values(by=["date"]).fillna(0)
-        )
-        merged_batting_stats = (
-            pd.concat(batting_data).sort_values(by=["date"]).fillna(0)
-        )
+        if self.workers > 1 and pa is not None:
+            features = self.parallel_player_features(tables)
+        else:
+            features = {}
+            for table, data in tables.items():
+                print(f"Generating {table} data")
+                features[table] = self.player_features(table, data)
 
-        merged_pitching_stats["inningspitched"] = convert_innings_pitched(
-            merged_pitching_stats["inningspitched"]
+        self.batting_data = features["batting"].drop_duplicates(
+            ["player_id", "game_id"]
         )
-        print("Generating batting data")
-        self.batting_data = self.generate_batting_averages(merged_batting_stats)
-        self.batting_data = self.batting_data.drop_duplicates(["player_id", "game_id"])
-        print("Generating pitching data")
-        self.pitching_data = self.generate_pitching_averages(merged_pitching_stats)
-        self.pitching_data = self.pitching_data.drop_duplicates(
+        self.pitching_data = features["pitching"].drop_duplicates(
             ["player_id", "game_id"]
         )
-        print("Generating fielding data")
-        self.fielding_data = self.generate_fielding_averages(merged_fielding_stats)
-        self.fielding_data = self.fielding_data.drop_duplicates(
+        self.fielding_data = features["fielding"].drop_duplicates(
             ["player_id", "game_id"]
         )
 
-    def generate_pitching_averages(self, data):
-        modified_groups = []
-        grouped = data.groupby(["player_id"])
-        count = 0
-        for name, group in grouped:
-            group = group.sort_values(by=["date"])
-            if count % 10 == 0:
-                print(count / len(grouped))
-            count += 1
-            group = self.running_pitching_averages(group)
-            modified_groups.append(group)
-        return pd.concat(modified_groups)
-
-    def generate_fielding_averages(self, data):
-        modified_groups = []
-        grouped = data.groupby(["player_id"])
-        count = 0
-        for name, group in grouped:
-            group = group.sort_values(by=["date"])
-            if count % 10 == 0:
-                print(count / len(grouped))
-            count += 1
-            group = self.running_fielding_averages(group)
-            modified_groups.append(group)
-        return pd.concat(modified_groups)
-
-    def generate_batting_averages(self, data):
-        modified_groups = []
-        grouped = data.groupby(["player_id"])
-        count = 0
-        for name, group in grouped:
-            group = group.sort_values(by=["date"])
-            if count % 10 == 0:
-                print(count / len(grouped))
-            count += 1
-            group = self.running_batting_averages(group)
-            modified_groups.append(group)
-        return pd.concat(modified_groups)
-
-    def running_pitching_averages(self, group):
-        averaging_columns = [
-            col
-            for col in group.columns
-            if col
-            not in [
-                "game_id",
-                "player_id",
-                "team_id",
-                "name",
-                "date",
-                "gamesstarted",
-                "position",
-                "summary",
-                "note",
-                "stolenbasepercentage",
-                "strikepercentage",
-                "runsscoredper9",
-                "homerunsper9",
-                "atbats",
-                "position",
-                "battingorder",
+    def player_features(self, table, data, seeds=None):
+        data = fill_missing(data)
+        if table == "fielding":
+            return self.generate_fielding_averages(data, seeds)
+        generate = {
+            "batting": self.generate_batting_averages,
+            "pitching": self.generate_pitching_averages,
+        }[table]
+        return generate(data)
+
+    def parallel_player_features(self, tables):
+        # Player tables are sharded by player_id across a process pool that
+        # memory-maps them from uncompressed Arrow files
+        from concurrent.futures import ProcessPoolExecutor
+
+        features = {}
+        with tempfile.TemporaryDirectory() as shared_dir:
+            tasks = []
+            for table, data in tables.items():
+                path = os.path.join(shared_dir, f"{table}.arrow")
+                feather.write_feather(
+                    pa.Table.from_pandas(data, preserve_index=False),
+                    path,
+                    compression="uncompressed",
+                )
+                for shard in range(self.workers):
+                    tasks.append(
+                        (table, path, shard, self.workers, self.span, self.shift)
+                    )
+
+            print(f"Generating player data with {self.workers} workers")
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                shards = list(executor.map(player_feature_shard, tasks))
+
+        for table in tables:
+            parts = [
+                part
+                for task, part in zip(tasks, shards)
+                if task[0] == table and part is not None
             ]
-            and "running" not in col
-            and "rolling" not in col
-        ]
-
-        new_columns = {}
-        for span_factor in [1, 2, 10]:
-            at_bats = (
-                group["atbats"]
-                .rolling(window=int(self.span / span_factor), min_periods=1)
-                .sum()
-                .shift(self.shift)
+            features[table] = (
+                pd.concat(parts, ignore_index=True)
+                .sort_values(by=["player_id"], kind="stable")
+                .reset_index(drop=True)
             )
-            for col in averaging_columns:
-
-                running_avg_col_name = f"running_avg_{col}_{int(self.span/span_factor)}"
-                # Perform the calculation and store the result in the container
-                per_at_bat = (
-                    group[col]
-                    .rolling(window=int(self.span / span_factor), min_periods=1)
-                    .sum()
-                    .shift(self.shift)
-                ) / at_bats
-                new_columns[running_avg_col_name] = per_at_bat
-            group = reconstruct_lost_pitching_stats(
-                group, int(self.span / span_factor), self.shift
-            )
-            group[f"rolling_atbats_{int(self.span / span_factor)}"] = at_bats
-
-        # Create a new DataFrame from the container
-        new_columns_df = pd.DataFrame(new_columns, index=group.index)
+        return features
 
-        # Concatenate the new DataFrame with the original group DataFrame
-        group = pd.concat([group, new_columns_df], axis=1)
+    def sort_players(self, data):
+        # One table sorted by player and date, grouped kernels run over every
+        # player at once
+        return data.sort_values(
+            by=["player_id", "date", "game_id"], kind="stable"
+        ).reset_index(drop=True)
 
-        # Drop the original averaging columns
-        group = group.drop(columns=averaging_columns)
-        group = group.drop(
-            columns=[
-                "stolenbasepercentage",
-                "strikepercentage",
-                "runsscoredper9",
-                "homerunsper9",
-                "summary",
-                "note",
-                "position",
-                "battingorder",
-                "atbats",
-            ]
-        )
-
-        return group
+    def generate_pitching_averages(self, data):
+        data = self.sort_players(data)
+        return self.running_pitching_averages(data, [data["player_id"]])
 
-    def running_fielding_averages(self, group):
-        averaging_columns = [
-            col
-            for col in group.columns
-            if col
-            not in [
-                "game_id",
-                "player_id",
-                "team_id",
-                "name",
-                "date",
-                "position",
-                "stolenbasepercentage",
-                "battingorder",
-            ]
-            and "running" not in col
-            and "rolling" not in col
-        ]
+    def generate_fielding_averages(self, data, seeds=None):
+        data = self.sort_players(data)
+        return self.running_fielding_averages(data, [data["player_id"]], seeds)
 
-        new_columns = {}
+    def generate_batting_averages(self, data):
+        data = self.sort_players(data)
+        return self.running_batting_averages(data, [data["player_id"]])
+
+    def running_per_at_bat(self, data, keys, averaging_columns, reconstruct):
+        # Rolling sums of every averaging column and at-bats in one grouped pass
+        # per span, divided by the rolling at-bats
+        blocks = []
+        running_avgs = []
         for span_factor in [1, 2, 10]:
-            for col in averaging_columns:
-
-                running_avg_col_name = f"running_avg_{col}_{int(self.span/span_factor)}"
-                # Perform the calculation and store the result in the container
-                new_columns[running_avg_col_name] = (
-                    group[col]
-                    .ewm(span=int(self.span / span_factor), min_periods=1)
-                    .mean()
-                    .shift(self.shift)
-                )
-            group = reconstruct_lost_fielding_stats(
-                group, int(self.span / span_factor), self.shift
+            span = int(self.span / span_factor)
+            rolling = rolling_sum(
+                data[averaging_columns + ["atbats"]], span, self.shift, keys
             )
+            at_bats = rolling["atbats"]
+            per_at_bat = rolling[averaging_columns].div(at_bats, axis=0)
+            per_at_bat.columns = [
+                f"running_avg_{col}_{span}" for col in averaging_columns
+            ]
+            running_avgs.append(per_at_bat)
+            blocks.append(reconstruct(data, span, self.shift, keys))
+            blocks.append(at_bats.rename(f"rolling_atbats_{span}").to_frame())
+        return blocks + running_avgs
 
-        # Create a new DataFrame from the container
-        new_columns_df = pd.DataFrame(new_columns, index=group.index)
+    def running_pitching_averages(self, data, keys):
+        averaging_columns = select_averaging_columns("pitching", data.columns)
 
-        # Concatenate the new DataFrame with the original group DataFrame
-        group = pd.concat([group, new_columns_df], axis=1)
+        blocks = self.running_per_at_bat(
+            data, keys, averaging_columns, reconstruct_lost_pitching_stats
+        )
 
         # Drop the original averaging columns
-        group = group.drop(columns=averaging_columns)
-        group = group.drop(columns=["stolenbasepercentage"])
-        return group
+        data = data.drop(columns=averaging_columns + ["atbats"])
+        data = data.drop(columns=UNUSED_COLUMNS["pitching"], errors="ignore")
 
-    def running_batting_averages(self, group):
-        averaging_columns = [
-            col
-            for col in group.columns
-            if col
-            not in [
-                "game_id",
-                "player_id",
-                "team_id",
-                "summary",
-                "note",
-                "name",
-                "date",
-                "position",
-                "stolenbasepercentage",
-                "atbatsperhomerun",
-                "atbats",
-                "battingorder",
-            ]
-            and "running" not in col
-            and "rolling" not in col
-        ]
+        return pd.concat([data] + blocks, axis=1)
 
-        new_columns = {}
+    def running_fielding_averages(self, data, keys, seeds=None):
+        # seeds maps each span to the saved EWM state of every player, see
+        # FeatureStore
+        averaging_columns = select_averaging_columns("fielding", data.columns)
+
+        blocks = []
+        running_avgs = []
         for span_factor in [1, 2, 10]:
-            at_bats = (
-                group["atbats"]
-                .rolling(window=int(self.span / span_factor), min_periods=1)
-                .sum()
-                .shift(self.shift)
-            )
-            for col in averaging_columns:
-                running_avg_col_name = f"running_avg_{col}_{int(self.span/span_factor)}"
-                # Perform the calculation and store the result in the container
-                per_at_bat = (
-                    group[col]
-                    .rolling(window=int(self.span / span_factor), min_periods=1)
-                    .sum()
-                    .shift(self.shift)
-                ) / (at_bats)
-                new_columns[running_avg_col_name] = per_at_bat
-            group = reconstruct_lost_batting_stats(
-                group, int(self.span / span_factor), self.shift
-            )
-            group[f"rolling_atbats_{int(self.span / span_factor)}"] = at_bats
+            span = int(self.span / span_factor)
+            seed = None
+            if seeds is not None:
+                seed = seeds[span].reindex(data["player_id"]).set_axis(data.index)
+            running = ewm_mean(data[averaging_columns], span, self.shift, keys, seed)
+            running.columns = [f"running_avg_{col}_{span}" for col in averaging_columns]
+            running_avgs.append(running)
+            blocks.append(reconstruct_lost_fielding_stats(data, span, self.shift, keys))
 
-        # Create a new DataFrame from the container
-        new_columns_df = pd.DataFrame(new_columns, index=group.index)
+        # Drop the original averaging columns
+        data = data.drop(columns=averaging_columns)
+        data = data.drop(columns=UNUSED_COLUMNS["fielding"], errors="ignore")
+        return pd.concat([data] + blocks + running_avgs, axis=1)
 
-        # Concatenate the new DataFrame with the original group DataFrame
-        group = pd.concat([group, new_columns_df], axis=1)
+    def running_batting_averages(self, data, keys):
+        averaging_columns = select_averaging_columns("batting", data.columns)
 
-        # Drop the original averaging columns
-        group = group.drop(columns=averaging_columns)
-        group = group.drop(
-            columns=[
-                "stolenbasepercentage",
-                "summary",
-                "note",
-                "atbatsperhomerun",
-                "atbats",
-            ]
+        blocks = self.running_per_at_bat(
+            data, keys, averaging_columns, reconstruct_lost_batting_stats
         )
-        return group
+
+        # Drop the original averaging columns
+        data = data.drop(columns=averaging_columns + ["atbats"])
+        data = data.drop(columns=UNUSED_COLUMNS["batting"], errors="ignore")
+        return pd.concat([data] + blocks, axis=1)
 
     def generate_all_rosters(self):
 
-        profiles = []
-        count = 0
-        for game in self.games.itertuples():
-            if count % 10 == 0:
-                print(count / len(self.games))
-            count += 1
-            game_id = game.game_id
-            date = game.date
-            home_team = game.home_id
-            away_team = game.away_id
-            home_roster = self.generate_roster(home_team, game_id, date)
-            away_roster = self.generate_roster(away_team, game_id, date)
-            profiles.append(home_roster)
-            profiles.append(away_roster)
+        # One (game_id, team_id) row per team per game, home team first
+        games = self.games
+        game_keys = pd.DataFrame(
+            {
+                "game_id": np.repeat(games["game_id"].to_numpy(), 2),
+                "team_id": np.column_stack(
+                    [games["home_id"].to_numpy(), games["away_id"].to_numpy()]
+                ).ravel(),
+                "date": np.repeat(games["date"].to_numpy(), 2),
+            }
+        ).set_index(ROSTER_KEYS)
+
+        print("Generating starting pitchers")
+        pitchers = self.pitching_data[self.pitching_data["gamesstarted"] == 1]
+        self.check_roster_counts(pitchers, game_keys.index, 1, "pitchers")
+        pitchers = pitchers.set_index(ROSTER_KEYS)
+        pitchers = pitchers[
+            [col for col in pitchers.columns if col not in PITCHER_NONSTAT_COLUMNS]
+        ].add_prefix("SP_")
+
+        print("Generating lineups")
+        batters = self.assign_batting_slots(game_keys.index)
+        self.check_roster_counts(
+            batters.drop_duplicates(ROSTER_KEYS), game_keys.index, 1, "lineups"
+        )
+        lineup_sizes = batters.groupby(ROSTER_KEYS).size()
+        if (lineup_sizes < 9).any():
+            # Teams that used fewer than nine batters with at-bats
+            print(
+                f"{(lineup_sizes < 9).sum()} lineups have fewer than 9 batters, "
+                "their empty slots are left missing"
+            )
+        batters = wide_profile(batters, "slot", "batter_")
+
+        print("Generating fielders")
+        # Positions become columns in order of first appearance going through
+        # the games in schedule order. A position listed twice for a team keeps
+        # its first column and the last row's stats.
+        fielders = self.fielding_data
+        game_order = game_keys.index.get_indexer(
+            pd.MultiIndex.from_frame(fielders[ROSTER_KEYS])
+        )
+        fielders = fielders.iloc[np.argsort(game_order, kind="stable")][
+            np.sort(game_order) >= 0
+        ]
+        self.check_roster_counts(fielders, game_keys.index, 9, "fielders")
+        fielders = wide_profile(
+            fielders.drop_duplicates(ROSTER_KEYS + ["position"], keep="last"),
+            "position",
+            "fielder_",
+            slots=pd.unique(fielders["position"]),
+        )
+
         print("Concatenating rosters")
+        self.rosters = (
+            pd.concat(
+                [
+                    game_keys,
+                    pitchers.reindex(game_keys.index),
+                    batters.reindex(game_keys.index),
+                    fielders.reindex(game_keys.index),
+                ],
+                axis=1,
+            )
+            .reset_index()
+            .sort_values(by=["date"])
+        )
 
-        self.rosters = pd.DataFrame()
-        chunk = []
-        for i in range(len(profiles)):
-            if (i + 1) % 1000 == 0 or i == len(profiles) - 1:
-                self.rosters = pd.concat([self.rosters, pd.DataFrame(chunk)])
-                chunk = []
+    def check_roster_counts(self, rows, game_index, expected, name):
+        counts = rows.groupby(ROSTER_KEYS).size().reindex(game_index, fill_value=0)
+        wrong = counts[counts != expected]
+        if len(wrong):
+            print(f"Expected {expected} {name} per team and game, found")
+            print(wrong)
+            assert len(wrong) == 0
+
+    def assign_batting_slots(self, game_index):
+        # Slots 1-9 for every lineup, taken in table order when a team has nine
+        # starters
+        data = self.batting_data
+        starter = data["battingorder"] % 100 == 0
+        starter_counts = starter.groupby([data["game_id"], data["team_id"]]).transform(
+            "sum"
+        )
 
-            chunk.append(profiles[i])
+        full = data[starter & (starter_counts == 9)].copy()
+        full["slot"] = full.groupby(ROSTER_KEYS).cumcount() + 1
 
-        self.rosters = pd.DataFrame(profiles).sort_values(by=["date"])
+        in_games = pd.MultiIndex.from_frame(data[ROSTER_KEYS]).isin(game_index)
+        incomplete = data[(starter_counts != 9).to_numpy() & in_games]
+        return pd.concat([full, self.resolve_lineups(incomplete)])
 
-    def generate_roster(self, team, game_id, date):
+    def resolve_lineups(self, data):
+        # Starters first, then the slot's first pinch hitter, then remaining batters
+        # by rolling at-bats
+        data = data.assign(row=np.arange(len(data)))
+        slot_keys = ROSTER_KEYS + ["slot"]
 
-        pitchers = self.pitching_data[
-            (self.pitching_data["game_id"] == game_id)
-            & (self.pitching_data["team_id"] == team)
-            & (self.pitching_data["gamesstarted"] == 1)
-        ]
+        order = data["battingorder"]
+        candidates = pd.concat(
+            [
+                data[order % 100 == 0].assign(slot=order // 100, priority=0),
+                data[order % 100 == 1].assign(slot=(order - 1) // 100, priority=1),
+            ]
+        )
+        candidates = candidates[candidates["slot"].between(1, 9)]
+        assigned = candidates.sort_values(
+            by=["priority", "row"], kind="stable"
+        ).drop_duplicates(slot_keys)[ROSTER_KEYS + ["player_id", "slot", "row"]]
+
+        # Empty slots of each lineup and the unused batters of each team, both
+        # ranked so the n-th empty slot takes the n-th batter
+        slots = (
+            data[ROSTER_KEYS]
+            .drop_duplicates()
+            .merge(pd.DataFrame({"slot": range(1, 10)}), how="cross")
+        )
+        missing = slots.merge(
+            assigned[slot_keys], on=slot_keys, how="left", indicator=True
+        )
+        missing = missing[missing["_merge"] == "left_only"].drop(columns="_merge")
+        missing["rank"] = missing.groupby(ROSTER_KEYS).cumcount()
+
+        unused = data.merge(
+            assigned[ROSTER_KEYS + ["player_id"]],
+            on=ROSTER_KEYS + ["player_id"],
+            how="left",
+            indicator=True,
+        )
+        unused = (
+            unused[unused["_merge"] == "left_only"]
+            .sort_values(
+                by=f"rolling_atbats_{self.span}", ascending=False, kind="stable"
+            )
+            .drop_duplicates(ROSTER_KEYS + ["player_id"])
+        )
+        unused["rank"] = unused.groupby(ROSTER_KEYS).cumcount()
+        filled = missing.merge(
+            unused[ROSTER_KEYS + ["rank", "row"]], on=ROSTER_KEYS + ["rank"]
+        )
 
-        batters = self.batting_data[
-            (self.batting_data["game_id"] == game_id)
-            & (self.batting_data["team_id"] == team)
-            & (self.batting_data["battingorder"] != None)
-            & (self.batting_data["battingorder"] % 100 == 0)
-        ]
-        fielders = self.fielding_data[
-            (self.fielding_data["game_id"] == game_id)
-            & (self.fielding_data["team_id"] == team)
-        ]
+        lineups = pd.concat(
+            [assigned[slot_keys + ["row"]], filled[slot_keys + ["row"]]]
+        ).sort_values(by=slot_keys)
+        return (
+            data.iloc[lineups["row"]]
+            .assign(slot=lineups["slot"].astype(int).to_numpy())
+            .drop(columns="row")
+        )
+
+    def spill_team_data(self):
+        # Team features wait in an uncompressed Arrow file while the player
+        # features and rosters are built, save_data maps them back in. Without
+        # pyarrow they stay in memory.
+        self.team_spill = None
+        if feather is None:
+            return
+        self.team_spill = tempfile.TemporaryDirectory()
+        feather.write_feather(
+            self.team_data,
+            os.path.join(self.team_spill.name, "team_data.arrow"),
+            compression="uncompressed",
+        )
+        del self.team_data
 
-        profile = {"game_id": game_id, "team_id": team, "date": date}
-
-        if len(pitchers) != 1:
-            print(pitchers)
-            assert len(pitchers) == 1
-        if len(batters) != 9:
-            all_batters = self.batting_data[
-                (self.batting_data["game_id"] == game_id)
-                & (self.batting_data["team_id"] == team)
-                & (self.batting_data["battingorder"] != None)
-            ].sort_values(by=["battingorder"])
-
-            # Separate starters and pinch hitters
-            starters = all_batters[all_batters["battingorder"] % 100 == 0].copy()
-            pinch_hitters = all_batters[all_batters["battingorder"] % 100 == 1].copy()
-
-            # Create a dictionary to keep track of batting order positions
-            batting_order = {i: None for i in range(100, 1000, 100)}
-
-            # Fill the batting order with starters first
-            for _, batter in starters.iterrows():
-                batting_order[batter["battingorder"]] = batter
-
-            # Fill in pinch hitters where there are no starters
-            for _, batter in pinch_hitters.iterrows():
-                order = batter["battingorder"] - 1
-                if batting_order[order] is None:
-                    batting_order[order] = batter
-
-                    # Identify missing spots and fill with the batter with the most at-bats
-            missing_spots = [
-                order for order, batter in batting_order.items() if batter is None
+    def save_data(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        if self.team_spill is not None:
+            path = os.path.join(self.team_spill.name, "team_data.arrow")
+            self.team_data = feather.read_table(path, memory_map=True).to_pandas()
+            self.team_spill.cleanup()
+
+        # A background thread writes the artifacts in turn while the complete
+        # profiles are joined. More writers would each hold their own chunk of
+        # formatted text.
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            print("Saving games, team data, player data and rosters")
+            writes = [
+                writer.submit(df.to_csv, f"{name}.csv")
+                for name, df in [
+                    ("games", self.games),
+                    ("team_data", self.team_data),
+                    ("pitching_data", self.pitching_data),
+                    ("fielding_data", self.fielding_data),
+                    ("batting_data", self.batting_data),
+                    ("rosters", self.rosters),
+                ]
             ]
-            all_batters_sorted = batters.sort_values(
-                by="rolling_atbats_50", ascending=False
+
+            print("Saving complete profiles")
+            self.complete_profiles = join_profiles(self.team_data, self.rosters)
+            writes.append(
+                writer.submit(self.complete_profiles.to_csv, "complete_profiles.csv")
             )
+            for write in writes:
+                write.result()
 
-            batters_included = batting_order.values()
 
-            for order in missing_spots:
-                for _, batter in all_batters_sorted.iterrows():
-                    if batter["player_id"] not in [batters_included]:
-                        batting_order[order] = batter
-                        break
+def join_profiles(team_data, rosters):
+    # Inner join of team features and rosters, in (game_id, team_id) order
+    team = team_data.set_index(ROSTER_KEYS).sort_index()
+    lineups = rosters.drop(columns="date").set_index(ROSTER_KEYS).sort_index()
+    return team.join(lineups, how="inner").reset_index()
 
-            # Collect the final list of all_batters
-            batters = pd.DataFrame(
-                [batter for batter in batting_order.values() if batter is not None]
-            )
-            if len(batters) != 9:
-                print(all_batters["battingorder"])
-                assert len(batters) == 9
-        if len(fielders) != 9:
-            print(fielders)
-            assert len(fielders) == 9
-
-        # Add pitcher stats to profile
-        for index, row in pitchers.iterrows():
-            for stat in row.index:
-                if stat not in [
-                    "game_id",
-                    "team_id",
-                    "gamesstarted",
-                    "date",
-                    "player_id",
-                    "name",
-                ]:
-                    profile_key = f"SP_{stat}"
-                    profile[profile_key] = row[stat]
-
-        # Add batters stats to profile
-        nonstat_columns = [
-            "game_id",
-            "team_id",
-            "battingorder",
-            "date",
-            "player_id",
-            "name",
-            "position",
-        ]
-        count = 1
-        for index, row in batters.iterrows():
-            for stat in row.index:
-                if stat not in nonstat_columns:
-                    profile_key = f"batter_{count}_{stat}"
-                    profile[profile_key] = row[stat]
-            count += 1
-
-            # Add fielders stats to profile
-        for index, row in fielders.iterrows():
-            for stat in row.index:
-                if stat not in nonstat_columns:
-                    profile_key = f"fielder_{row['position']}_{stat}"
-                    profile[profile_key] = row[stat]
-        return profile
 
-    def save_data(self):
-        print("Saving games")
-        self.games.to_csv("games.csv")
+def wide_profile(rows, slot_column, prefix, slots=None):
+    # One row per team and game, every player stat as {prefix}{slot}_{stat}
+    stats = [
+        col for col in rows.columns if col not in NONSTAT_COLUMNS and col != slot_column
+    ]
+    if slots is None:
+        slots = pd.unique(rows[slot_column])
+    wide = rows.set_index(ROSTER_KEYS + [slot_column])[stats].unstack(slot_column)
+    wide = wide[[(stat, slot) for slot in slots for stat in stats]]
+    wide.columns = [f"{prefix}{slot}_{stat}" for slot in slots for stat in stats]
+    return wide
 
-        print("Saving player data")
-        self.pitching_data.to_csv("pitching_data.csv")
-        self.fielding_data.to_csv("fielding_data.csv")
-        self.batting_data.to_csv("batting_data.csv")
 
-        print("Saving rosters")
-        self.rosters.to_csv("rosters.csv")
-        print("Saving complete profiles")
+def player_shard(player_ids, workers):
+    return player_ids % workers
 
-        self.team_data = pd.read_csv("team_data.csv")
 
-        self.complete_profiles = pd.merge(
-            self.team_data, self.rosters, on=["game_id", "team_id", "date"], how="inner"
-        )
-        self.complete_profiles.to_csv("complete_profiles.csv")
+def player_feature_shard(task):
+    # Process pool entry point, features of one player_id shard of a table
+    table, path, shard, workers, span, shift = task
+    shared = feather.read_table(path, memory_map=True)
+    rows = np.flatnonzero(
+        player_shard(shared.column("player_id").to_numpy(), workers) == shard
+    )
+    if len(rows) == 0:
+        return None
+    data = shared.take(rows).to_pandas()
+    worker = Preprocessor(None, span, shift, False, load=False)
+    return worker.player_features(table, data)
 
 
 if __name__ == "__main__":
-    Preprocessor([2024], 50, 1, True)
+    import argparse
+
+    from featurematrix import export_feature_matrix
+    from featurestore import FeatureStore
+
+    parser = argparse.ArgumentParser(prog="preprocessing")
+    parser.add_argument(
+        "-s",
+        "--seasons",
+        help="Seasons to build features for",
+        type=int,
+        nargs="+",
+        default=[2024],
+    )
+    parser.add_argument("--span", type=int, default=50)
+    parser.add_argument("--shift", type=int, default=1)
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Processes used to build player features",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--storage",
+        help="Backend the per-season tables are read from",
+        choices=["parquet", "csv"],
+        default="parquet",
+    )
+    parser.add_argument(
+        "--data-dir",
+        help="Root directory of the stored tables",
+        default=None,
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        help="Only process games missing from the feature store, one season at "
+        "a time",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--features-dir",
+        help="Root directory of the feature store",
+        default="features",
+    )
+    parser.add_argument(
+        "-x",
+        "--export",
+        help="Also write the complete profiles as a float32 feature matrix to "
+        "this directory",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    features = None
+    if args.incremental:
+        features = FeatureStore(args.features_dir, args.span, args.shift)
+    preprocessor = Preprocessor(
+        args.seasons,
+        args.span,
+        args.shift,
+        True,
+        storage=get_storage(args.storage, args.data_dir),
+        workers=args.workers,
+        features=features,
+    )
+    if args.export:
+        if features is not None:
+            profiles = features.read("complete_profiles")
+        else:
+            profiles = preprocessor.complete_profiles
+        export_feature_matrix(profiles, args.export)
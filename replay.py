@@ -0,0 +1,192 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import requests
+from mlbstatsapi.mlb_dataadapter import MlbDataAdapter, MlbResult
+
+from atomicfile import atomic_write
+
+
+def fixture_key(kind, request):
+    return hashlib.sha1(
+        json.dumps([kind, request], sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class FixtureStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, kind, request):
+        return os.path.join(
+            self.directory, kind, f"{fixture_key(kind, request)}.json.gz"
+        )
+
+    def save(self, kind, request, response):
+        with atomic_write(self.path(kind, request)) as tmp_path:
+            with gzip.open(tmp_path, "wt") as file:
+                json.dump({"request": request, "response": response}, file, default=str)
+
+    def load(self, kind, request):
+        try:
+            with gzip.open(self.path(kind, request), "rt") as file:
+                return json.load(file)["response"]
+        except FileNotFoundError:
+            raise KeyError(f"No {kind} fixture for {request}")
+
+
+class RecordingAdapter:
+    """
+    MlbDataAdapter stand-in that forwards to the live API and saves every response.
+    """
+
+    def __init__(self, directory="fixtures", adapter=None):
+        self.fixtures = FixtureStore(directory)
+        self.adapter = adapter or MlbDataAdapter()
+
+    def get(self, endpoint, ep_params=None, data=None):
+        result = self.adapter.get(endpoint=endpoint, ep_params=ep_params)
+        self.fixtures.save(
+            "api",
+            {"endpoint": endpoint, "params": ep_params or {}},
+            {
+                "status_code": result.status_code,
+                "message": result.message,
+                "data": result.data,
+            },
+        )
+        return result
+
+
+class ReplayAdapter:
+    """
+    MlbDataAdapter stand-in that serves recorded responses, waiting latency
+    seconds per request to imitate the network.
+    """
+
+    def __init__(self, directory="fixtures", latency=0.0):
+        self.fixtures = FixtureStore(directory)
+        self.latency = latency
+        self.requests = 0
+
+    def get(self, endpoint, ep_params=None, data=None):
+        response = self.fixtures.load(
+            "api", {"endpoint": endpoint, "params": ep_params or {}}
+        )
+        self.requests += 1
+        time.sleep(self.latency)
+        return MlbResult(response["status_code"], response["message"], response["data"])
+
+
+class RecordingSession:
+    def __init__(self, directory="fixtures"):
+        self.fixtures = FixtureStore(directory)
+
+    def get(self, url):
+        response = requests.get(url)
+        self.fixtures.save("html", {"url": url}, {"text": response.text})
+        return response
+
+
+class ReplaySession:
+    def __init__(self, directory="fixtures", latency=0.0):
+        self.fixtures = FixtureStore(directory)
+        self.latency = latency
+
+    def get(self, url):
+        response = self.fixtures.load("html", {"url": url})
+        time.sleep(self.latency)
+        return ReplayResponse(response["text"])
+
+
+class ReplayResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+def install(mode, directory="fixtures", latency=0.0):
+    """
+    Route every MLB Stats API request and the starting lineups page through
+    recorded fixtures, mode is "record" or "replay". Returns the adapter so it can
+    be handed to a ResponseCache.
+    """
+    import util
+    import rosters
+
+    if mode == "record":
+        adapter = RecordingAdapter(directory)
+        session = RecordingSession(directory)
+    else:
+        adapter = ReplayAdapter(directory, latency)
+        session = ReplaySession(directory, latency)
+
+    util.adapter = adapter
+    util.people.adapter = adapter
+    rosters.session = session
+    return adapter
+
+
+def benchmark(args):
+    from apirequests import DataFetcher
+    from cache import ResponseCache
+    from storage import get_storage
+    import rosters
+    import util
+
+    fixtures = os.path.abspath(args.fixtures)
+    adapter = install(args.mode, fixtures, args.latency)
+    util.get_american_teams.cache_clear()
+
+    # Run in a scratch directory with empty caches so every request is made and
+    # the real data files are left alone
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        util.people.people = {}
+        util.people.dirty = False
+        start = time.perf_counter()
+        for season in args.seasons:
+            DataFetcher(
+                season,
+                use_existing=False,
+                workers=args.workers,
+                cache=ResponseCache(adapter=adapter),
+                storage=get_storage("parquet"),
+                batch_size=args.batch_size,
+            )
+        print(f"Fetched {args.seasons} in {time.perf_counter() - start:.2f}s")
+
+        if args.lineups:
+            start = time.perf_counter()
+            matchups = rosters.generate_matchup_dicts(rosters.get_raw_matchups())
+            print(
+                f"Parsed {len(matchups)} lineups in {time.perf_counter() - start:.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="replay")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("-s", "--seasons", type=int, nargs="+", default=[2023])
+    parser.add_argument("-f", "--fixtures", default="fixtures")
+    parser.add_argument(
+        "-l",
+        "--latency",
+        help="Seconds to wait per replayed request",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument("-w", "--workers", type=int, default=8)
+    parser.add_argument("-b", "--batch-size", type=int, default=100)
+    parser.add_argument(
+        "--lineups",
+        help="Also fetch and parse the starting lineups page",
+        action="store_true",
+        default=False,
+    )
+    benchmark(parser.parse_args())
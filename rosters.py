@@ -3,11 +3,14 @@ from bs4 import BeautifulSoup
 import re
 import json
 
+# Replaced by replay.install to serve recorded pages
+session = requests.Session()
+
 
 def get_raw_matchups():
 
     url = "https://www.mlb.com/starting-lineups"
-    response = requests.get(url)
+    response = session.get(url)
     html = response.text
 
     soup = BeautifulSoup(html, "html.parser")
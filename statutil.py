@@ -1,57 +1,179 @@
+import numpy as np
 import pandas as pd
 
 
 def convert_innings_pitched(column):
-    def convert_inning(inning_float):
-        # Split the integer and fractional part
-        whole_innings = int(inning_float)
-        outs = (inning_float - whole_innings) * 10
-        true_inning = whole_innings + (outs / 3)
-        return true_inning
-
-    return column.apply(convert_inning)
-
-
-def reconstruct_lost_team_stats(group, span, shift):
-
-    rolling_columns = [
-        "batting_hits",
-        "batting_atbats",
-        "batting_baseonballs",
-        "batting_homeruns",
-        "batting_hitbypitch",
-        "batting_sacflies",
-        "batting_totalbases",
-        "batting_stolenbases",
-        "batting_caughtstealing",
-        "fielding_caughtstealing",
-        "fielding_stolenbases",
-        "pitching_baseonballs",
-        "pitching_hitbypitch",
-        "pitching_atbats",
-        "pitching_sacflies",
-        "pitching_caughtstealing",
-        "pitching_stolenbases",
-        "pitching_hits",
-        "pitching_strikes",
-        "pitching_pitchesthrown",
-        "pitching_earnedruns",
-        "pitching_inningspitched",
-        "pitching_groundouts",
-        "pitching_airouts",
-    ]
-
-    rolling = (
-        group[rolling_columns]
-        .rolling(window=int(span), min_periods=1)
-        .sum()
-        .shift(shift)
-    )
-
-    group[f"rolling_batting_avg_{span}"] = (
+    # Innings pitched are reported as whole innings and outs, 6.2 is 6 2/3
+    # innings. Working in rounded tenths keeps the outs exact, where
+    # (x - int(x)) * 10 can give 1.9999. Missing values stay missing.
+    tenths = np.round(column.to_numpy(dtype="float64") * 10)
+    innings = np.trunc(tenths / 10) + np.fmod(tenths, 10) / 3
+    return pd.Series(innings, index=column.index, name=column.name).astype(column.dtype)
+
+
+def convert_inning(value):
+    # convert_innings_pitched for a single value
+    if value != value:
+        return value
+    tenths = round(value * 10)
+    return tenths // 10 + tenths % 10 / 3
+
+
+def signed_streak(win, keys):
+    # Length of the current run of wins (positive) or losses (negative) at each
+    # game, restarting for every group in keys
+    win = win.astype(bool)
+    outcome = win.astype(int)
+    run_start = outcome.ne(outcome.groupby(keys).shift())
+    run_id = run_start.groupby(keys).cumsum()
+    run_length = win.groupby(keys + [run_id]).cumcount() + 1
+    return run_length.where(win, -run_length)
+
+
+def group_codes(keys):
+    # One integer label per row for the groups in keys. Grouping a frame by a
+    # plain array skips pandas' check of each key Series against the columns.
+    codes = keys[0].groupby(keys, sort=False).ngroup().to_numpy(dtype=float)
+    codes[codes < 0] = np.nan
+    return codes
+
+
+def grouped_rolling(frame, span, shift, keys, how):
+    # Shifted rolling aggregate over the last span rows, run per group when keys
+    # are given
+    if keys is None:
+        rolling = frame.rolling(window=int(span), min_periods=1).agg(how)
+        return rolling.shift(shift)
+    # Window sums as the difference of running totals span rows apart, which
+    # stays in grouped cumsum/shift instead of building windows group by group.
+    # Totals run in float64 and the result takes the width of frame.
+    keys = group_codes(keys)
+    totals = frame.fillna(0).astype("float64").groupby(keys).cumsum()
+    counts = frame.notna().astype(float).groupby(keys).cumsum()
+    totals = totals - totals.groupby(keys).shift(int(span)).fillna(0)
+    counts = counts - counts.groupby(keys).shift(int(span)).fillna(0)
+    rolling = totals if how == "sum" else totals / counts
+    return rolling.where(counts > 0).groupby(keys).shift(shift).astype(frame.dtypes)
+
+
+def rolling_sum(frame, span, shift, keys=None):
+    return grouped_rolling(frame, span, shift, keys, "sum")
+
+
+def rolling_mean(frame, span, shift, keys=None):
+    return grouped_rolling(frame, span, shift, keys, "mean")
+
+
+def ewm_state(frame, span, keys=None, seed=None):
+    """
+    Unshifted exponentially weighted mean of every column per group, along with
+    the total weight behind it at each row. seed continues each group from saved
+    state: it is aligned with frame and holds, for every row, the mean of its
+    group's earlier rows and their weight in a "weight" column.
+    """
+    if keys is None:
+        keys = [pd.Series(0, index=frame.index)]
+    keys = group_codes(keys)
+    mean = (
+        frame.groupby(keys)
+        .ewm(span=int(span), min_periods=1)
+        .mean()
+        .reset_index(level=0, drop=True)
+        .reindex(frame.index)
+    )
+    # Weights of the adjusted EWM: 1 for the latest row, decaying for older ones
+    decay = 1 - 2 / (int(span) + 1)
+    decays = decay ** (frame.groupby(keys).cumcount() + 1)
+    weight = (1 - decays) / (1 - decay)
+    if seed is not None:
+        seed_weight = seed["weight"].fillna(0) * decays
+        seed_mean = seed.reindex(columns=frame.columns).fillna(0)
+        seeded = (mean.mul(weight, axis=0) + seed_mean.mul(seed_weight, axis=0)).div(
+            weight + seed_weight, axis=0
+        )
+        mean = seeded.where(seed_weight > 0, mean, axis=0)
+        weight = weight + seed_weight
+    return mean.astype(frame.dtypes), weight
+
+
+def ewm_mean(frame, span, shift, keys=None, seed=None):
+    # Shifted exponentially weighted mean, run per group when keys are given
+    if keys is None and seed is None:
+        return frame.ewm(span=int(span), min_periods=1).mean().shift(shift)
+    mean, _ = ewm_state(frame, span, keys, seed)
+    if keys is None:
+        return mean.shift(shift)
+    return mean.groupby(keys).shift(shift)
+
+
+TEAM_ROLLING_COLUMNS = [
+    "batting_hits",
+    "batting_atbats",
+    "batting_baseonballs",
+    "batting_homeruns",
+    "batting_hitbypitch",
+    "batting_sacflies",
+    "batting_totalbases",
+    "batting_stolenbases",
+    "batting_caughtstealing",
+    "fielding_caughtstealing",
+    "fielding_stolenbases",
+    "pitching_baseonballs",
+    "pitching_hitbypitch",
+    "pitching_atbats",
+    "pitching_sacflies",
+    "pitching_caughtstealing",
+    "pitching_stolenbases",
+    "pitching_hits",
+    "pitching_strikes",
+    "pitching_pitchesthrown",
+    "pitching_earnedruns",
+    "pitching_inningspitched",
+    "pitching_groundouts",
+    "pitching_airouts",
+]
+
+PITCHING_ROLLING_COLUMNS = [
+    "baseonballs",
+    "hitbypitch",
+    "atbats",
+    "sacflies",
+    "caughtstealing",
+    "stolenbases",
+    "hits",
+    "strikes",
+    "pitchesthrown",
+    "earnedruns",
+    "inningspitched",
+    "groundouts",
+    "airouts",
+    "homeruns",
+]
+
+FIELDING_ROLLING_COLUMNS = ["caughtstealing", "stolenbases"]
+
+BATTING_ROLLING_COLUMNS = [
+    "hits",
+    "atbats",
+    "baseonballs",
+    "homeruns",
+    "hitbypitch",
+    "sacflies",
+    "totalbases",
+    "stolenbases",
+    "caughtstealing",
+]
+
+
+def team_rates(rolling, span):
+    # Rate stats from summed counts, rolling maps each of the table's
+    # *_ROLLING_COLUMNS to its sum over the window. Works on Series or scalars.
+    stats = {}
+
+    stats[f"rolling_batting_avg_{span}"] = (
         rolling["batting_hits"] / rolling["batting_atbats"]
     )
-    group[f"rolling_batting_obp_{span}"] = (
+    stats[f"rolling_batting_obp_{span}"] = (
         rolling["batting_hits"]
         + rolling["batting_baseonballs"]
         + rolling["batting_hitbypitch"]
@@ -62,25 +184,25 @@ def reconstruct_lost_team_stats(group, span, shift):
         + rolling["batting_sacflies"]
     )
 
-    group[f"rolling_batting_slg_{span}"] = (
+    stats[f"rolling_batting_slg_{span}"] = (
         rolling["batting_totalbases"] / rolling["batting_atbats"]
     )
-    group[f"rolling_batting_ops_{span}"] = (
-        group[f"rolling_batting_obp_{span}"] + group[f"rolling_batting_slg_{span}"]
+    stats[f"rolling_batting_ops_{span}"] = (
+        stats[f"rolling_batting_obp_{span}"] + stats[f"rolling_batting_slg_{span}"]
     )
 
-    group[f"rolling_batting_stolenbasepercentage_{span}"] = rolling[
+    stats[f"rolling_batting_stolenbasepercentage_{span}"] = rolling[
         "batting_stolenbases"
     ] / (rolling["batting_stolenbases"] + rolling["batting_caughtstealing"])
-    group[f"rolling_batting_homerunsperatbat_{span}"] = (
+    stats[f"rolling_batting_homerunsperatbat_{span}"] = (
         rolling["batting_homeruns"] / rolling["batting_atbats"]
     )
 
-    group[f"rolling_fielding_stolenbasepercentage_{span}"] = rolling[
+    stats[f"rolling_fielding_stolenbasepercentage_{span}"] = rolling[
         "fielding_caughtstealing"
     ] / (rolling["fielding_caughtstealing"] + rolling["fielding_stolenbases"])
 
-    group[f"rolling_pitching_obp_{span}"] = (
+    stats[f"rolling_pitching_obp_{span}"] = (
         rolling["pitching_hits"]
         + rolling["pitching_baseonballs"]
         + rolling["pitching_hitbypitch"]
@@ -90,99 +212,72 @@ def reconstruct_lost_team_stats(group, span, shift):
         + rolling["pitching_hitbypitch"]
         + rolling["pitching_sacflies"]
     )
-    group[f"rolling_pitching_stolenbasepercentage_{span}"] = rolling[
+    stats[f"rolling_pitching_stolenbasepercentage_{span}"] = rolling[
         "pitching_caughtstealing"
     ] / (rolling["pitching_caughtstealing"] + rolling["pitching_stolenbases"])
-    group[f"rolling_pitching_era_{span}"] = (
+    stats[f"rolling_pitching_era_{span}"] = (
         rolling["pitching_earnedruns"] * 9
     ) / rolling["pitching_inningspitched"]
-    group[f"rolling_pitching_whip_{span}"] = (
+    stats[f"rolling_pitching_whip_{span}"] = (
         rolling["pitching_hits"] + rolling["pitching_baseonballs"]
     ) / rolling["pitching_inningspitched"]
-    group[f"rolling_pitching_groundoutstoairouts_{span}"] = (
+    stats[f"rolling_pitching_groundoutstoairouts_{span}"] = (
         rolling["pitching_groundouts"] / rolling["pitching_airouts"]
     )
-    group[f"rolling_pitching_strikepercentage_{span}"] = (
+    stats[f"rolling_pitching_strikepercentage_{span}"] = (
         rolling["pitching_strikes"] / rolling["pitching_pitchesthrown"]
     )
 
-    return group
+    return stats
 
 
-def reconstruct_lost_pitching_stats(group, span, shift):
-    rolling_columns = [
-        "baseonballs",
-        "hitbypitch",
-        "atbats",
-        "sacflies",
-        "caughtstealing",
-        "stolenbases",
-        "hits",
-        "strikes",
-        "pitchesthrown",
-        "earnedruns",
-        "inningspitched",
-        "groundouts",
-        "airouts",
-        "homeruns",
-    ]
+def reconstruct_lost_team_stats(group, span, shift, keys=None):
+    rolling = rolling_sum(group[TEAM_ROLLING_COLUMNS], span, shift, keys)
+    return pd.DataFrame(team_rates(rolling, span), index=group.index)
 
-    rolling = (
-        group[rolling_columns]
-        .rolling(window=int(span), min_periods=1)
-        .sum()
-        .shift(shift)
-    )
 
-    group[f"rolling_stolenbasepercentage_{span}"] = rolling["caughtstealing"] / (
+def pitching_rates(rolling, span):
+    stats = {}
+
+    stats[f"rolling_stolenbasepercentage_{span}"] = rolling["caughtstealing"] / (
         rolling["stolenbases"] + rolling["caughtstealing"]
     )
-    group[f"rolling_strikepercentage_{span}"] = (
+    stats[f"rolling_strikepercentage_{span}"] = (
         rolling["strikes"] / rolling["pitchesthrown"]
     )
-    group[f"rolling_runsscoredper9_{span}"] = (
+    stats[f"rolling_runsscoredper9_{span}"] = (
         rolling["earnedruns"] / rolling["inningspitched"] * 9.0
     )
-    group[f"rolling_homerunsper9_{span}"] = (
+    stats[f"rolling_homerunsper9_{span}"] = (
         rolling["homeruns"] / rolling["inningspitched"] * 9.0
     )
-    return group
+    return stats
 
 
-def reconstruct_lost_fielding_stats(group, span, shift):
-    rolling_columns = ["caughtstealing", "stolenbases"]
-    rolling = (
-        group[rolling_columns]
-        .rolling(window=int(span), min_periods=1)
-        .sum()
-        .shift(shift)
-    )
-    group[f"rolling_stolenbases_{span}"] = rolling["caughtstealing"] / (
+def reconstruct_lost_pitching_stats(group, span, shift, keys=None):
+    rolling = rolling_sum(group[PITCHING_ROLLING_COLUMNS], span, shift, keys)
+    return pd.DataFrame(pitching_rates(rolling, span), index=group.index)
+
+
+def fielding_rates(rolling, span):
+    stats = {}
+    stats[f"rolling_stolenbases_{span}"] = rolling["caughtstealing"] / (
         rolling["stolenbases"] + rolling["caughtstealing"]
     )
 
-    return group
+    return stats
 
 
-def reconstruct_lost_batting_stats(group, span, shift):
-    rolling_columns = [
-        "hits",
-        "atbats",
-        "baseonballs",
-        "homeruns",
-        "hitbypitch",
-        "sacflies",
-        "totalbases",
-        "stolenbases",
-        "caughtstealing",
-    ]
+def reconstruct_lost_fielding_stats(group, span, shift, keys=None):
+    rolling = rolling_sum(group[FIELDING_ROLLING_COLUMNS], span, shift, keys)
+    return pd.DataFrame(fielding_rates(rolling, span), index=group.index)
 
-    rolling = (
-        group[rolling_columns].rolling(window=span, min_periods=1).sum().shift(shift)
-    )
 
-    group[f"rolling_avg_{span}"] = rolling["hits"] / rolling["atbats"]
-    group[f"rolling_obp_{span}"] = (
+def batting_rates(rolling, span):
+    stats = {}
+
+    stats[f"rolling_avg_{span}"] = rolling["hits"] / rolling["atbats"]
+    stats[f"rolling_obp_{span}"] = (
         rolling["hits"] + rolling["baseonballs"] + rolling["hitbypitch"]
     ) / (
         rolling["atbats"]
@@ -191,13 +286,18 @@ def reconstruct_lost_batting_stats(group, span, shift):
         + rolling["sacflies"]
     )
 
-    group[f"rolling_slg_{span}"] = rolling["totalbases"] / rolling["atbats"]
-    group[f"rolling_ops_{span}"] = (
-        group[f"rolling_obp_{span}"] + group[f"rolling_slg_{span}"]
+    stats[f"rolling_slg_{span}"] = rolling["totalbases"] / rolling["atbats"]
+    stats[f"rolling_ops_{span}"] = (
+        stats[f"rolling_obp_{span}"] + stats[f"rolling_slg_{span}"]
     )
 
-    group[f"rolling_stolenbasepercentage_{span}"] = rolling["stolenbases"] / (
+    stats[f"rolling_stolenbasepercentage_{span}"] = rolling["stolenbases"] / (
         rolling["stolenbases"] + rolling["caughtstealing"]
     )
-    group[f"rolling_homerunsperatbat_{span}"] = rolling["homeruns"] / rolling["atbats"]
-    return group
+    stats[f"rolling_homerunsperatbat_{span}"] = rolling["homeruns"] / rolling["atbats"]
+    return stats
+
+
+def reconstruct_lost_batting_stats(group, span, shift, keys=None):
+    rolling = rolling_sum(group[BATTING_ROLLING_COLUMNS], span, shift, keys)
+    return pd.DataFrame(batting_rates(rolling, span), index=group.index)
@@ -0,0 +1,332 @@
+import glob
+import os
+import shutil
+
+import pandas as pd
+
+from atomicfile import atomic_write
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+# Table name -> suffix of the legacy {season}_{suffix}.csv files
+TABLES = {
+    "games": "games",
+    "team": "team_stats",
+    "pitching": "pitching_stats",
+    "batting": "batting_stats",
+    "fielding": "fielding_stats",
+}
+
+# Every column not listed in a table's schema is a stat count/rate. Stats that
+# the API reports as text ("6.2", ".250", "-.--") are parsed here, with
+# placeholders such as "-.--" becoming NaN.
+STAT_DTYPE = "float64"
+
+PLAYER_SCHEMA = {
+    "player_id": "int64",
+    "date": "date",
+    "name": "object",
+    "position": "object",
+    "game_id": "int64",
+    "team_id": "int64",
+    "battingorder": "float64",
+    "batside": "object",
+    "pitchhand": "object",
+    "summary": "object",
+    "note": "object",
+}
+
+SCHEMAS = {
+    "games": {
+        "game_id": "int64",
+        "home_team": "object",
+        "home_score": "int64",
+        "home_id": "int64",
+        "away_team": "object",
+        "away_score": "int64",
+        "away_id": "int64",
+        "date": "date",
+    },
+    "team": {
+        "name": "object",
+        "teamCode": "object",
+        "team_id": "int64",
+        "date": "date",
+        "game_id": "int64",
+        "win": "bool",
+        "home": "bool",
+    },
+    "pitching": PLAYER_SCHEMA,
+    "batting": PLAYER_SCHEMA,
+    "fielding": PLAYER_SCHEMA,
+}
+
+# Narrower dtypes for reads that feed the feature pipeline. Stat counts are
+# exact in float32, ids fit in small ints and repeated text is categorical.
+COMPACT_STAT_DTYPE = "float32"
+
+COMPACT_DTYPES = {
+    "player_id": "int32",
+    "game_id": "int32",
+    "team_id": "int16",
+    "home_id": "int16",
+    "away_id": "int16",
+    "battingorder": "float32",
+}
+
+CATEGORICAL_COLUMNS = ["name", "teamCode", "position"]
+
+
+def apply_schema(table, df):
+    schema = SCHEMAS[table]
+    columns = {}
+    for col in df.columns:
+        dtype = schema.get(col, STAT_DTYPE)
+        values = df[col]
+        if dtype == "date":
+            # Dates stay "YYYY-MM-DD" strings, which is what the schedule
+            # returns and what the preprocessing joins expect
+            columns[col] = pd.to_datetime(values).dt.strftime("%Y-%m-%d")
+        elif dtype == "object":
+            # Text columns hold str or None so every backend stores them as strings
+            values = values.astype(object)
+            columns[col] = values.astype(str).where(values.notna(), None)
+        elif dtype == STAT_DTYPE:
+            columns[col] = pd.to_numeric(values, errors="coerce").astype(dtype)
+        else:
+            columns[col] = values.astype(dtype)
+    return pd.DataFrame(columns, index=df.index)
+
+
+def compact_schema(table, df):
+    # Casts the numeric columns of a schema-typed frame, categorize() is left
+    # for after frames are concatenated so they share one set of categories
+    schema = SCHEMAS[table]
+    dtypes = {}
+    for col in df.columns:
+        if col in COMPACT_DTYPES:
+            dtypes[col] = COMPACT_DTYPES[col]
+        elif col not in schema:
+            dtypes[col] = COMPACT_STAT_DTYPE
+    return df.astype(dtypes)
+
+
+def categorize(df):
+    return df.astype(
+        {col: "category" for col in CATEGORICAL_COLUMNS if col in df.columns}
+    )
+
+
+# Column of the CSV files recording the ingest batch of every row
+BATCH_COLUMN = "_batch"
+
+
+class CsvStorage:
+    """
+    The original one-file-per-season layout, {season}_{table suffix}.csv. Each
+    row records the batch that appended it in a _batch column, so rollback can
+    remove the rows of batches that never committed. Rows of files written
+    before batches were recorded count as batch 0.
+    """
+
+    def __init__(self, root="."):
+        self.root = root
+
+    def path(self, table, season):
+        return os.path.join(self.root, f"{season}_{TABLES[table]}.csv")
+
+    def watermark_path(self, season):
+        return os.path.join(self.root, f"{season}_watermark.json")
+
+    def columns(self, table, seasons):
+        columns = {}
+        for season in seasons:
+            if os.path.exists(self.path(table, season)):
+                for col in pd.read_csv(self.path(table, season), nrows=0).columns:
+                    if col != BATCH_COLUMN:
+                        columns[col] = None
+        return list(columns)
+
+    def read(self, table, seasons, columns=None, compact=False, months=None):
+        frames = []
+        for season in seasons:
+            if not os.path.exists(self.path(table, season)):
+                continue
+            usecols = None if columns is None else lambda col: col in columns
+            frame = pd.read_csv(self.path(table, season), usecols=usecols)
+            frames.append(frame.drop(columns=BATCH_COLUMN, errors="ignore"))
+        if not frames:
+            return pd.DataFrame()
+        df = apply_schema(table, pd.concat(frames, ignore_index=True))
+        if months is not None:
+            # A season is one file, months can only be filtered after reading
+            df = df[df["date"].str[5:7].isin(months)].reset_index(drop=True)
+        if compact:
+            df = categorize(compact_schema(table, df))
+        return df
+
+    def rows(self, table, season):
+        # Every stored row of a season along with its batch
+        path = self.path(table, season)
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        df = pd.read_csv(path)
+        batches = df.pop(BATCH_COLUMN) if BATCH_COLUMN in df.columns else 0
+        return apply_schema(table, df).assign(**{BATCH_COLUMN: batches})
+
+    def save(self, table, season, rows):
+        with atomic_write(self.path(table, season)) as tmp_path:
+            rows.to_csv(tmp_path, index=False)
+
+    def write(self, table, season, df):
+        if df.empty:
+            return
+        self.save(table, season, apply_schema(table, df).assign(**{BATCH_COLUMN: 0}))
+
+    def append(self, table, season, df, batch):
+        # CSV files can't be appended to safely once the columns change, so the
+        # whole season is rewritten. Use the parquet backend for cheap appends.
+        if df.empty:
+            return
+        rows = apply_schema(table, df).assign(**{BATCH_COLUMN: batch})
+        self.save(
+            table,
+            season,
+            pd.concat([self.rows(table, season), rows], ignore_index=True),
+        )
+
+    def drop(self, table, season):
+        if os.path.exists(self.path(table, season)):
+            os.remove(self.path(table, season))
+
+    def rollback(self, season, batches):
+        # A batch appends to every table before the watermark commits it, rows
+        # of batches missing from batches are removed from each file
+        for table in TABLES:
+            for tmp_path in glob.glob(f"{self.path(table, season)}.*tmp"):
+                os.remove(tmp_path)
+            rows = self.rows(table, season)
+            if rows.empty:
+                continue
+            committed = rows[BATCH_COLUMN].isin(batches)
+            if not committed.all():
+                self.save(table, season, rows[committed])
+
+
+class ParquetStorage:
+    """
+    Parquet files partitioned as {root}/{table}/season={season}/month={month}/.
+    Each ingest batch adds its own part-{batch}.parquet file to the months it
+    touches. Reads only open the requested seasons, months and columns.
+    """
+
+    def __init__(self, root="data"):
+        if pq is None:
+            raise ImportError("The parquet storage backend requires pyarrow")
+        self.root = root
+
+    def season_dir(self, table, season):
+        return os.path.join(self.root, table, f"season={season}")
+
+    def watermark_path(self, season):
+        return os.path.join(self.root, f"{season}_watermark.json")
+
+    def files(self, table, seasons, months=None):
+        # months are "MM" strings, None is every month
+        files = []
+        for season in seasons:
+            for month_dir in sorted(
+                glob.glob(os.path.join(self.season_dir(table, season), "month=*"))
+            ):
+                if months is None or month_dir[-2:] in months:
+                    files += sorted(glob.glob(os.path.join(month_dir, "*.parquet")))
+        return files
+
+    def columns(self, table, seasons):
+        columns = {}
+        for file in self.files(table, seasons):
+            for col in pq.read_schema(file).names:
+                if not col.startswith("__"):
+                    columns[col] = None
+        return list(columns)
+
+    def read(self, table, seasons, columns=None, compact=False, months=None):
+        frames = []
+        for file in self.files(table, seasons, months):
+            file_columns = None
+            if columns is not None:
+                # Stat columns vary a little between seasons, only ask each
+                # file for the columns it actually has
+                names = set(pq.read_schema(file).names)
+                file_columns = [col for col in columns if col in names]
+            frame = pd.read_parquet(file, columns=file_columns)
+            if compact:
+                # Cast file by file so the full-width table never exists
+                frame = compact_schema(table, frame)
+            frames.append(frame)
+        if not frames:
+            return pd.DataFrame()
+        df = pd.concat(frames, ignore_index=True)
+        if compact:
+            df = categorize(df)
+        return df
+
+    def write(self, table, season, df):
+        self.drop(table, season)
+        self.append(table, season, df, 0)
+
+    def append(self, table, season, df, batch):
+        df = apply_schema(table, df).reset_index(drop=True)
+        if df.empty:
+            return
+        for month, part in df.groupby(df["date"].str[5:7], sort=True):
+            month_dir = os.path.join(self.season_dir(table, season), f"month={month}")
+            path = os.path.join(month_dir, f"part-{batch:05d}.parquet")
+            with atomic_write(path) as tmp_path:
+                part.to_parquet(tmp_path, index=False)
+
+    def drop(self, table, season):
+        shutil.rmtree(self.season_dir(table, season), ignore_errors=True)
+
+    def rollback(self, season, batches):
+        # Remove parts of batches that were written but never committed, along
+        # with temporary files left by an interrupted write
+        for table in TABLES:
+            pattern = os.path.join(self.season_dir(table, season), "month=*", "part-*")
+            for path in glob.glob(pattern):
+                batch = int(os.path.basename(path)[5:10])
+                if path.endswith(".tmp") or batch not in batches:
+                    os.remove(path)
+
+
+BACKENDS = {"csv": CsvStorage, "parquet": ParquetStorage}
+
+
+def get_storage(backend="parquet", root=None):
+    if root is None:
+        return BACKENDS[backend]()
+    return BACKENDS[backend](root)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="storage")
+    parser.add_argument(
+        "seasons",
+        help="Seasons to copy from the legacy CSV files into parquet",
+        type=int,
+        nargs="+",
+    )
+    args = parser.parse_args()
+
+    csv_storage = CsvStorage()
+    parquet_storage = ParquetStorage()
+    for season in args.seasons:
+        for table in TABLES:
+            parquet_storage.write(table, season, csv_storage.read(table, [season]))
+            print(f"Converted {season} {table}")
@@ -0,0 +1,336 @@
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from preprocessing import Preprocessor, select_averaging_columns
+from statutil import (
+    BATTING_ROLLING_COLUMNS,
+    FIELDING_ROLLING_COLUMNS,
+    PITCHING_ROLLING_COLUMNS,
+    TEAM_ROLLING_COLUMNS,
+    batting_rates,
+    convert_inning,
+    fielding_rates,
+    pitching_rates,
+    team_rates,
+)
+from storage import TABLES, get_storage
+
+
+class RollingSums:
+    """
+    Sums over the last span rows for several spans, kept from one ring buffer of
+    the last max(spans) rows. Each push adds the new row and takes out the row
+    that leaves every window.
+    """
+
+    __slots__ = ("spans", "rows", "count", "sums")
+
+    def __init__(self, spans, width):
+        self.spans = spans
+        self.rows = np.zeros((max(spans), width))
+        self.count = 0
+        self.sums = np.zeros((len(spans), width))
+
+    def push(self, values):
+        size = len(self.rows)
+        for i, span in enumerate(self.spans):
+            if self.count >= span:
+                self.sums[i] -= self.rows[(self.count - span) % size]
+        self.sums += values
+        self.rows[self.count % size] = values
+        self.count += 1
+
+
+class EwmMeans:
+    """
+    Adjusted exponentially weighted means for several spans, updated the way
+    pandas' ewm(span=span).mean() is.
+    """
+
+    __slots__ = ("decays", "means", "weights")
+
+    def __init__(self, spans, width):
+        alphas = np.array([1.0 / (1.0 + (span - 1) / 2.0) for span in spans])
+        self.decays = (1.0 - alphas)[:, None]
+        self.means = np.full((len(spans), width), np.nan)
+        self.weights = np.zeros((len(spans), 1))
+
+    def push(self, values):
+        if not self.weights.any():
+            self.means = np.tile(values, (len(self.means), 1))
+            self.weights[:] = 1.0
+            return
+        self.weights *= self.decays
+        updated = (self.weights * self.means + values) / (self.weights + 1.0)
+        self.means = np.where(self.means != values, updated, self.means)
+        self.weights += 1.0
+
+
+class EntityState:
+    # Window state of one player or team-season in one table. snapshots holds
+    # the sums and means after each of the last shift rows, the oldest one is
+    # what the next row's features are built from.
+
+    __slots__ = ("rolling", "ewm", "snapshots")
+
+    def __init__(self, layout, spans, shift):
+        self.rolling = RollingSums(spans, len(layout.rolling_columns))
+        self.ewm = None
+        if layout.ewm_columns:
+            self.ewm = EwmMeans(spans, len(layout.ewm_columns))
+        self.snapshots = deque(maxlen=max(shift, 1))
+
+    def snapshot(self):
+        means = None if self.ewm is None else self.ewm.means.copy()
+        return self.rolling.sums.copy(), means
+
+
+class TableLayout:
+    """
+    Which columns of a table's rows are summed and which are averaged, matching
+    the running averages and reconstructed stats Preprocessor builds for it.
+    """
+
+    __slots__ = (
+        "table",
+        "averaging",
+        "rolling_columns",
+        "ewm_columns",
+        "rates",
+        "rolling_innings",
+        "ewm_innings",
+    )
+
+    def __init__(self, table, columns):
+        self.table = table
+        self.averaging = select_averaging_columns(table, columns)
+        if table in ("batting", "pitching"):
+            # Running averages are rolling sums per at-bat
+            reconstructed = {
+                "batting": BATTING_ROLLING_COLUMNS,
+                "pitching": PITCHING_ROLLING_COLUMNS,
+            }[table]
+            self.rolling_columns = list(
+                dict.fromkeys(self.averaging + ["atbats"] + reconstructed)
+            )
+            self.ewm_columns = []
+        else:
+            self.rolling_columns = {
+                "fielding": FIELDING_ROLLING_COLUMNS,
+                "team": TEAM_ROLLING_COLUMNS,
+            }[table]
+            self.ewm_columns = self.averaging
+        self.rates = {
+            "batting": batting_rates,
+            "pitching": pitching_rates,
+            "fielding": fielding_rates,
+            "team": team_rates,
+        }[table]
+        # Positions of the innings pitched columns, converted as rows come in
+        self.rolling_innings = innings_positions(self.rolling_columns)
+        self.ewm_innings = innings_positions(self.ewm_columns)
+
+
+def innings_positions(columns):
+    return [
+        i
+        for i, col in enumerate(columns)
+        if col in ("inningspitched", "pitching_inningspitched")
+    ]
+
+
+class StreamingFeatures:
+    """
+    Live counterpart of the player and team running averages and reconstructed
+    rate stats of Preprocessor. Every player (per table) and team-season keeps a
+    ring buffer of its last span stat rows and EWM accumulators, so adding a
+    row costs the same however long the history is. Features match the batch
+    pipeline for the same rows in the same order.
+
+    columns maps each table ("team", "batting", "pitching", "fielding") to the
+    columns of its stored rows.
+    """
+
+    def __init__(self, span, shift, columns):
+        self.span = span
+        self.shift = shift
+        self.spans = [int(span / span_factor) for span_factor in [1, 2, 10]]
+        self.layouts = {
+            table: TableLayout(table, table_columns)
+            for table, table_columns in columns.items()
+        }
+        self.states = {}
+
+    def entity(self, table, row):
+        if table == "team":
+            return table, str(row["date"])[:4], row["teamCode"]
+        return table, row["player_id"]
+
+    def values(self, columns, innings, row):
+        raw = [row.get(col) for col in columns]
+        try:
+            values = np.asarray(raw, dtype=float)
+        except (TypeError, ValueError):
+            # Unparsed text such as "-.--" counts as missing
+            values = pd.to_numeric(pd.Series(raw, dtype=object), errors="coerce")
+            values = values.to_numpy(dtype=float)
+        values[np.isnan(values)] = 0.0
+        for i in innings:
+            values[i] = convert_inning(values[i])
+        return values
+
+    def add(self, table, row):
+        """
+        Feed one stored row of table (a dict or Series) and return its features.
+        """
+        layout = self.layouts[table]
+        key = self.entity(table, row)
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = EntityState(layout, self.spans, self.shift)
+
+        features = None
+        if self.shift > 0 and len(state.snapshots) == self.shift:
+            features = state.snapshots[0]
+
+        state.rolling.push(
+            self.values(layout.rolling_columns, layout.rolling_innings, row)
+        )
+        if state.ewm is not None:
+            state.ewm.push(self.values(layout.ewm_columns, layout.ewm_innings, row))
+        state.snapshots.append(state.snapshot())
+
+        if self.shift == 0:
+            features = state.snapshots[-1]
+        return self.features(layout, features)
+
+    def add_box_score(self, tables):
+        """
+        Feed every row of one game, tables maps table names to that game's rows.
+        Returns the features of each table's rows.
+        """
+        return {
+            table: pd.DataFrame(
+                [self.add(table, row) for row in rows.to_dict("records")],
+                index=rows.index,
+            )
+            for table, rows in tables.items()
+        }
+
+    def features(self, layout, snapshot):
+        if snapshot is None:
+            # Fewer than shift earlier rows, the batch pipeline has no value yet
+            sums = np.full((len(self.spans), len(layout.rolling_columns)), np.nan)
+            means = np.full((len(self.spans), len(layout.ewm_columns)), np.nan)
+        else:
+            sums, means = snapshot
+
+        features = {}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i, span in enumerate(self.spans):
+                rolling = dict(zip(layout.rolling_columns, sums[i]))
+                features.update(layout.rates(rolling, span))
+                if layout.table in ("batting", "pitching"):
+                    features[f"rolling_atbats_{span}"] = rolling["atbats"]
+                    for col in layout.averaging:
+                        features[f"running_avg_{col}_{span}"] = (
+                            rolling[col] / rolling["atbats"]
+                        )
+                elif layout.table == "fielding":
+                    for col, mean in zip(layout.ewm_columns, means[i]):
+                        features[f"running_avg_{col}_{span}"] = mean
+                else:
+                    for col, mean in zip(layout.ewm_columns, means[i]):
+                        features[f"running_avg_{col}_last_{span}"] = mean
+
+        if layout.table == "team":
+            # Team data has its missing values filled with 0
+            features = {
+                name: 0.0 if np.isnan(value) else value
+                for name, value in features.items()
+            }
+        return features
+
+
+def replay(storage, seasons, span, shift):
+    """
+    Stream every stored row of seasons through StreamingFeatures in game order.
+    Returns table -> (rows, features).
+    """
+    tables = {}
+    for table in TABLES:
+        if table == "games":
+            continue
+        tables[table] = (
+            storage.read(table, seasons)
+            .sort_values(by=["date", "game_id"], kind="stable")
+            .reset_index(drop=True)
+        )
+    engine = StreamingFeatures(
+        span, shift, {table: list(rows.columns) for table, rows in tables.items()}
+    )
+    return {
+        table: (rows, engine.add_box_score({table: rows})[table])
+        for table, rows in tables.items()
+    }
+
+
+def cross_check(storage, seasons, span, shift):
+    """
+    Largest relative difference between the streamed and batch value of every
+    feature the streaming engine builds, per table.
+    """
+    batch = Preprocessor(seasons, span, shift, False, storage=storage)
+    batch_tables = {
+        "team": batch.team_data,
+        "batting": batch.batting_data,
+        "pitching": batch.pitching_data,
+        "fielding": batch.fielding_data,
+    }
+    differences = {}
+    for table, (rows, features) in replay(storage, seasons, span, shift).items():
+        keys = ["game_id", "team_id"] if table == "team" else ["player_id", "game_id"]
+        streamed = pd.concat([rows[keys], features], axis=1).drop_duplicates(keys)
+        expected = batch_tables[table].drop_duplicates(keys)
+        merged = streamed.merge(expected, on=keys, suffixes=("", "_batch"))
+        worst = 0.0
+        for col in features.columns:
+            a = merged[col].to_numpy(dtype=float)
+            b = merged[f"{col}_batch"].to_numpy(dtype=float)
+            both = np.isfinite(a) & np.isfinite(b)
+            if (np.isfinite(a) != np.isfinite(b)).any():
+                worst = np.inf
+            scale = np.maximum(np.abs(b[both]), 1.0)
+            if both.any():
+                worst = max(worst, float((np.abs(a[both] - b[both]) / scale).max()))
+        differences[table] = worst
+    return differences
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="streaming")
+    parser.add_argument("-s", "--seasons", type=int, nargs="+", default=[2024])
+    parser.add_argument("--span", type=int, default=50)
+    parser.add_argument("--shift", type=int, default=1)
+    parser.add_argument(
+        "--storage",
+        help="Backend the per-season tables are read from",
+        choices=["parquet", "csv"],
+        default="parquet",
+    )
+    parser.add_argument(
+        "--data-dir",
+        help="Root directory of the stored tables",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    differences = cross_check(
+        get_storage(args.storage, args.data_dir), args.seasons, args.span, args.shift
+    )
+    for table, difference in differences.items():
+        print(f"{table}: largest relative difference {difference:.3g}")
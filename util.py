@@ -1,8 +1,12 @@
 from tkinter import N
-import mlbstatsapi
+import time
+from functools import lru_cache
+from mlbstatsapi.mlb_dataadapter import MlbDataAdapter
 from numpy import true_divide
+from people import PeopleStore
 
-mlb = mlbstatsapi.Mlb()
+# Shared by the raw-payload lookups so a replay adapter can stand in for it
+adapter = MlbDataAdapter()
 
 
 def print_object_fields(obj):
@@ -17,8 +21,20 @@ def print_object_fields(obj):
         print(attr)
 
 
-batsides = {}
-pitchhands = {}
+def call_with_retries(func, *args, retries=3, backoff=1.0, **kwargs):
+    # Retry transient API failures with exponential backoff
+    for attempt in range(retries):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries - 1:
+                raise
+            delay = backoff * 2**attempt
+            print(f"Request failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+people = PeopleStore(adapter=adapter)
 
 
 def add_identifying_fields_to_dict(
@@ -32,20 +48,11 @@ def add_identifying_fields_to_dict(
     dict["game_id"] = game_id
     dict["team_id"] = team_id
     dict["battingorder"] = battingorder
-    if player_id not in batsides and position != 'P':
-        batsides[player_id] = mlb.get_person(player_id).batside.code
-        batside = batsides[player_id]
-    elif player_id in batsides:
-        batside = batsides[player_id]
-    else:
-        batside = None
-    dict["batside"] = batside
+    person = people.get(player_id)
+    dict["batside"] = person["batside"] if position != "P" else None
 
     if position == "P":
-        if player_id in pitchhands:
-            dict["pitchhand"] = pitchhands[player_id]
-        else:
-            dict["pitchhand"] = mlb.get_person(player_id).pitchhand.code
+        dict["pitchhand"] = person["pitchhand"]
 
 
 def merge_team_stats(team_dict, date, game_id, win, home):
@@ -85,6 +92,14 @@ def add_stats_to_list(stattype, list, player, date, dict, game_id, team_id, hand
         list.append(stats)
 
 
+def box_score_player_ids(box_score):
+    return [
+        int(player[2:])
+        for team in (box_score.teams.home, box_score.teams.away)
+        for player in team.players
+    ]
+
+
 def add_player_stats(team, date, pitcher_stats, batter_stats, fielder_stats, game_id):
     team_id = team.team.id
     for player, dict in team.players.items():
@@ -97,11 +112,11 @@ def add_player_stats(team, date, pitcher_stats, batter_stats, fielder_stats, gam
         )
 
 
-def get_american_teams():
-    teams = mlb.get_teams()
+@lru_cache(maxsize=None)
+def get_american_teams(cache):
     american_teams = set()
-    for team in teams:
-        if team.league.id == 103:
-            american_teams.add(team.id)
+    for team in cache.get_teams():
+        if team.get("league", {}).get("id") == 103:
+            american_teams.add(team["id"])
 
     return american_teams
@@ -0,0 +1,86 @@
+import json
+
+from atomicfile import atomic_write
+
+
+class Watermark:
+    """
+    Record of what has already been ingested for a season: the latest game date,
+    the set of gamePks and the storage batches they were written in. Games that
+    were scheduled but couldn't be ingested are kept in missing with their date.
+    Incremental runs start the schedule query at start_date() and skip any
+    gamePk already in game_ids. Saving the watermark is what commits a batch, storage parts from
+    batches missing here are discarded on the next run. Batch 0 holds data
+    written in one go (conversions and pre-batch ingests).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.last_date = None
+        self.game_ids = set()
+        self.batches = {0}
+        self.missing = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as file:
+                watermark = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return
+        self.last_date = watermark["last_date"]
+        self.game_ids = set(watermark["game_ids"])
+        self.batches = set(watermark.get("batches", [0]))
+        self.missing = {
+            int(game_id): date for game_id, date in watermark.get("missing", {}).items()
+        }
+
+    def empty(self):
+        return not self.game_ids
+
+    def reset(self):
+        self.last_date = None
+        self.game_ids = set()
+        self.batches = {0}
+        self.missing = {}
+
+    def next_batch(self):
+        return max(self.batches) + 1
+
+    def commit(self, batch, game_ids, dates):
+        self.update(game_ids, dates)
+        self.batches.add(batch)
+        self.save()
+
+    def skip(self, game_id, date):
+        self.missing[int(game_id)] = str(date)[:10]
+
+    def start_date(self):
+        # The schedule has to reach back to the earliest game still missing
+        dates = list(self.missing.values())
+        if self.last_date:
+            dates.append(self.last_date)
+        return min(dates) if dates else None
+
+    def update(self, game_ids, dates):
+        self.game_ids.update(int(game_id) for game_id in game_ids)
+        for game_id in self.game_ids.intersection(self.missing):
+            del self.missing[game_id]
+        dates = [str(d)[:10] for d in dates]
+        if dates:
+            self.last_date = max([self.last_date or dates[0]] + dates)
+
+    def save(self):
+        with atomic_write(self.path) as tmp_path, open(tmp_path, "w") as file:
+            json.dump(
+                {
+                    "last_date": self.last_date,
+                    "game_ids": sorted(self.game_ids),
+                    "batches": sorted(self.batches),
+                    "missing": {
+                        str(game_id): date
+                        for game_id, date in sorted(self.missing.items())
+                    },
+                },
+                file,
+            )